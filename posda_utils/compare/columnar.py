@@ -0,0 +1,100 @@
+# posda_utils/compare/columnar.py
+
+import pandas as pd
+from sqlalchemy import select
+
+from posda_utils.db.models import DicomElement
+
+# Long format: one row per (key, tag_path), the columns a tag matrix or comparison row needs
+ELEMENT_COLUMNS = ["tag_path", "tag", "tag_name", "tag_keyword", "tag_group", "tag_element",
+                   "tag_vm", "tag_vr", "is_private", "private_creator", "value"]
+TAG_COLUMNS = ["tag", "tag_name", "tag_vm", "tag_vr"]
+COMPARE_COLUMNS = ["tag", "tag_path", "tag_group", "tag_element", "tag_name", "tag_keyword",
+                   "tag_vr", "tag_vm", "is_private", "private_creator"]
+
+
+def explode_files(dicom_files, key="sop_uid"):
+    """Explode (key, DicomFile) pairs into a long DataFrame with one row per element."""
+    records = []
+    for key_value, dicom_file in dicom_files:
+        if not dicom_file.exists:
+            continue
+        for tag_path, r in (dicom_file.meta_dict | dicom_file.header_dict).items():
+            records.append((key_value, tag_path, r.label, r.name, r.keyword, r.group, r.element,
+                            r.vm, r.vr, r.is_private, r.private_creator, r.value))
+    return pd.DataFrame.from_records(records, columns=[key] + ELEMENT_COLUMNS)
+
+
+def load_elements(db_manager, group_name, uids=None, chunk_size=100000):
+    """Read a group's rows from the dicom_element table as a long DataFrame keyed by sop_uid.
+
+    No JSON is parsed; SQ values are already stored as '<REMOVED>'.
+    """
+    table = DicomElement.__table__
+    stmt = select(*[table.c[c] for c in ["sop_instance_uid"] + ELEMENT_COLUMNS])\
+        .where(table.c.group_name == group_name)
+    if uids is not None:
+        stmt = stmt.where(table.c.sop_instance_uid.in_(list(uids)))
+
+    chunks = list(db_manager.iter_query(stmt, df=True, chunk_size=chunk_size))
+    frame = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(
+        columns=["sop_instance_uid"] + ELEMENT_COLUMNS)
+    return frame.rename(columns={"sop_instance_uid": "sop_uid"})
+
+
+def build_tag_matrix(frames):
+    """Outer-join long frames (label -> DataFrame) on (sop_uid, tag_path) into tag_matrix rows.
+
+    Tag columns come from the first label that has the element, values of
+    sequences are shown as '<REMOVED>', as in tag_matrix.process_batch.
+    """
+    matrix = None
+    for label, frame in frames.items():
+        frame = frame.drop_duplicates(["sop_uid", "tag_path"])
+        values = frame["value"].where(frame["tag_vr"] != "SQ", "<REMOVED>")
+        side = frame[["sop_uid", "tag_path"] + TAG_COLUMNS].assign(**{f"{label}_value": values})
+        if matrix is None:
+            matrix = side
+            continue
+        matrix = matrix.merge(side, on=["sop_uid", "tag_path"], how="outer", suffixes=("", "_right"))
+        for column in TAG_COLUMNS:
+            matrix[column] = matrix[column].combine_first(matrix.pop(f"{column}_right"))
+
+    if matrix is None:
+        return pd.DataFrame(columns=["sop_uid", "tag_path"] + TAG_COLUMNS)
+    # Outer joins turn integer columns with gaps into floats
+    matrix["tag_vm"] = matrix["tag_vm"].astype("Int64")
+    columns = ["sop_uid", "tag_path"] + TAG_COLUMNS + [f"{label}_value" for label in frames]
+    return matrix[columns].sort_values(["sop_uid", "tag_path"], ignore_index=True)
+
+
+def diff_frames(left, left_label, right, right_label, key="sop_uid", only_diff=False):
+    """Hash-join two long frames on (key, tag_path) and compare values column-wise.
+
+    Returns rows in the DicomFileComparer shape, plus the key column: tag
+    columns from the left side where present, '<REMOVED>' for sequences,
+    and a vectorized 'different' flag.
+    """
+    merged = left.merge(right, on=[key, "tag_path"], how="outer", suffixes=("_01", "_02"))
+
+    value_01, value_02 = merged["value_01"], merged["value_02"]
+    different = (value_01 != value_02) & ~(value_01.isna() & value_02.isna())
+    if only_diff:
+        merged, different = merged[different], different[different]
+        value_01, value_02 = merged["value_01"], merged["value_02"]
+
+    result = pd.DataFrame({key: merged[key], "tag_path": merged["tag_path"]})
+    for column in COMPARE_COLUMNS:
+        if column != "tag_path":
+            result[column] = merged[f"{column}_01"].combine_first(merged[f"{column}_02"])
+
+    for column in ("tag_group", "tag_element", "tag_vm"):
+        result[column] = result[column].astype("Int64")
+
+    is_sequence = result["tag_vr"] == "SQ"
+    result[f"{left_label}_value"] = value_01.where(~is_sequence, "<REMOVED>")
+    result[f"{right_label}_value"] = value_02.where(~is_sequence, "<REMOVED>")
+    result["different"] = different
+
+    return result[[key] + COMPARE_COLUMNS + [f"{left_label}_value", f"{right_label}_value", "different"]]\
+        .sort_values([key, "tag_path"], ignore_index=True)
@@ -5,14 +5,24 @@ import logging
 import concurrent.futures as futures
 
 from posda_utils.compare.file_compare import DicomFileComparer
+from posda_utils.compare.columnar import explode_files, diff_frames
 from posda_utils.io.reader import DicomFile
 
+PAIR_COLUMNS = ['MetaData', 'HeaderData', 'SOPClassUID', 'Modality', 'PatientID',
+                'StudyInstanceUID', 'SeriesInstanceUID', 'SOPInstanceUID', 'FilePath']
+
 
 class DicomDirectoryComparer:
-    def __init__(self, multiproc=False, cpus=1, batch_size=1):
+    def __init__(self, multiproc=False, cpus=1, batch_size=1, only_diff=False, columnar=False, parse_cache=None):
+        """With columnar, each batch is exploded to long format and diffed column-wise;
+        use a batch_size in the hundreds or more so the vectorized join pays off.
+        parse_cache (a ParseCache) reuses the tag dictionaries of JSON parsed before."""
         self.multiproc = multiproc
+        self.only_diff = only_diff
+        self.columnar = columnar
         self.cpus = cpus
         self.batch_size = batch_size
+        self.parse_cache = parse_cache
         self.file_comparer = DicomFileComparer()
 
     def _build_base_record(self, d1_row, d2_row, d1_label, d2_label):
@@ -35,51 +45,92 @@ class DicomDirectoryComparer:
         }
 
     def compare_dicom_batch(self, dir_01_batch, dir_02_df, uid_map, d1_label, d2_label):
-        result_list = []
+        return self.compare_pairs(self._build_pairs(dir_01_batch, dir_02_df, uid_map), d1_label, d2_label)
 
-        for idx, d1_row in dir_01_batch.iterrows():
-            d1_file = DicomFile()
-            d1_file.from_json(d1_row.MetaData, d1_row.HeaderData, d1_row)
+    def compare_pairs(self, pairs, d1_label, d2_label):
+        """Compare (d1_record, d2_record) pairs; d2_record is None when the file has no counterpart."""
+        result_list = []
 
-            try:
-                d2_row = dir_02_df.loc[uid_map[idx]]
-                d2_file = DicomFile()
-                d2_file.from_json(d2_row.MetaData, d2_row.HeaderData, d2_row)
-            except KeyError:
-                d2_row = None
-                d2_file = DicomFile()  # empty comparison object
+        for d1_row, d2_row in pairs:
+            d1_file = self._load_file(d1_row)
+            d2_file = self._load_file(d2_row) if d2_row is not None else DicomFile()  # empty comparison object
 
             base_record = self._build_base_record(d1_row, d2_row, d1_label, d2_label)
             result_list.extend(
-                self.file_comparer.compare(base_record, d1_file, d1_label, d2_file, d2_label)
+                self.file_comparer.compare(base_record, d1_file, d1_label, d2_file, d2_label,
+                                           only_diff=self.only_diff)
             )
 
         return result_list
 
+    def compare_pairs_columnar(self, pairs, d1_label, d2_label):
+        """Compare pairs with a hash join of their long-format elements, return a DataFrame."""
+        files = [(self._load_file(d1_row), self._load_file(d2_row) if d2_row is not None else DicomFile())
+                 for d1_row, d2_row in pairs]
+        if self.only_diff:
+            keep = [i for i, (d1_file, d2_file) in enumerate(files)
+                    if not self.file_comparer.is_identical(d1_file, d2_file)]
+        else:
+            keep = range(len(files))
+
+        left = explode_files(((i, files[i][0]) for i in keep), key="pair")
+        right = explode_files(((i, files[i][1]) for i in keep), key="pair")
+        diff = diff_frames(left, d1_label, right, d2_label, key="pair", only_diff=self.only_diff)
+
+        base = pd.DataFrame([self._build_base_record(d1_row, d2_row, d1_label, d2_label) for d1_row, d2_row in pairs])
+        return base.merge(diff, left_index=True, right_on="pair").drop(columns="pair")
+
+    def _load_file(self, row):
+        dicom_file = DicomFile()
+        dicom_file.from_json(row.get('MetaData'), row.get('HeaderData'), None, info={'FilePath': row.get('FilePath')},
+                             parse_cache=self.parse_cache)
+        return dicom_file
+
+    def _build_pairs(self, dir_01_df, dir_02_df, uid_map):
+        """Join the two sides through uid_map into aligned (d1_record, d2_record) pairs.
+
+        Only the columns a comparison reads are kept, so a batch of pairs is
+        all a worker needs.
+        """
+        d1_records = dir_01_df[[c for c in PAIR_COLUMNS if c in dir_01_df.columns]].to_dict(orient='records')
+        d2_records = dict(zip(dir_02_df.index,
+                              dir_02_df[[c for c in PAIR_COLUMNS if c in dir_02_df.columns]].to_dict(orient='records')))
+
+        pairs = []
+        for idx, d1_record in zip(dir_01_df.index, d1_records):
+            d2_index = uid_map.get(idx)
+            pairs.append((d1_record, d2_records.get(d2_index) if d2_index is not None else None))
+        return pairs
+
     def compare_directories(self, dir_01_df, d1_label, dir_02_df, d2_label, uid_map, data_writer, table_name):
         logging.info("Comparing DICOM directories")
         data_writer.empty_table('analysis', table_name)
 
         all_results = []
 
+        # Each worker is sent only its own pairs, so IPC grows with the number of files, not its square
+        pairs = self._build_pairs(dir_01_df, dir_02_df, uid_map)
+
+        compare_func = self.compare_pairs_columnar if self.columnar else self.compare_pairs
         if self.multiproc:
-            batches = [dir_01_df.iloc[i:i + self.batch_size] for i in range(0, len(dir_01_df), self.batch_size)]
+            batches = [pairs[i:i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]
             with futures.ProcessPoolExecutor(max_workers=self.cpus) as executor:
                 futures_list = [
                     executor.submit(
-                        self.compare_dicom_batch,
+                        compare_func,
                         batch,
-                        dir_02_df,
-                        uid_map,
                         d1_label,
                         d2_label
                     ) for batch in batches
                 ]
                 for future in futures.as_completed(futures_list):
-                    all_results.extend(future.result())
+                    all_results.append(future.result())
         else:
-            all_results.extend(self.compare_dicom_batch(dir_01_df, dir_02_df, uid_map, d1_label, d2_label))
+            all_results.append(compare_func(pairs, d1_label, d2_label))
 
-        if all_results:
-            result_df = pd.DataFrame(all_results)
+        if self.columnar:
+            result_df = pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
+        else:
+            result_df = pd.DataFrame([row for rows in all_results for row in rows])
+        if not result_df.empty:
             data_writer.write_to_table('analysis', result_df, table_name, mode='replace')
@@ -5,8 +5,11 @@ class DicomFileComparer:
         pass
 
     # Compare two DicomFile objects and return tag-by-tag differences
-    def compare(self, base_record, dicom_01, dicom_01_label, dicom_02, dicom_02_label):
-        
+    def compare(self, base_record, dicom_01, dicom_01_label, dicom_02, dicom_02_label, only_diff=False):
+        """Return one row per tag in either file, or with only_diff just the differing rows."""
+        if only_diff:
+            return list(self.iter_differences(base_record, dicom_01, dicom_01_label, dicom_02, dicom_02_label))
+
         comparison = []
 
         d1_dict = dicom_01.meta_dict | dicom_01.header_dict if dicom_01.exists else {}
@@ -15,51 +18,61 @@ class DicomFileComparer:
         tag_keys = sorted(set(d1_dict.keys()) | set(d2_dict.keys()))
 
         for tag_key in tag_keys:
-            row = base_record.copy()
-
-            tag_01 = d1_dict.get(tag_key, {})
-            tag_02 = d2_dict.get(tag_key, {})
-
-            row["tag"] = tag_01.get("label") or tag_02.get("label")
-            row["tag_path"] = tag_key
-
-            try:
-                element = tag_01["element"]
-                row["tag_group"] = element.tag.group
-                row["tag_element"] = element.tag.element
-                row["tag_name"] = element.name
-                row["tag_keyword"] = element.keyword
-                row["tag_vr"] = element.VR
-                row["tag_vm"] = element.VM
-                row["is_private"] = element.is_private
-                row["private_creator"] = element.private_creator
-            except KeyError:
-                try:
-                    element = tag_02["element"]
-                    row["tag_group"] = element.tag.group
-                    row["tag_element"] = element.tag.element
-                    row["tag_name"] = element.name
-                    row["tag_keyword"] = element.keyword
-                    row["tag_vr"] = element.VR
-                    row["tag_vm"] = element.VM
-                    row["is_private"] = element.is_private
-                    row["private_creator"] = element.private_creator
-                except KeyError:
-                    row.update({
-                        "tag_group": None,
-                        "tag_element": None,
-                        "tag_name": None,
-                        "tag_keyword": None,
-                        "tag_vr": None,
-                        "tag_vm": None,
-                        "is_private": None,
-                        "private_creator": None
-                    })
-
-            row[f"{dicom_01_label}_value"] = tag_01.get("value") if not row["tag_vr"] == "SQ" else "<REMOVED>"
-            row[f"{dicom_02_label}_value"] = tag_02.get("value") if not row["tag_vr"] == "SQ" else "<REMOVED>"
-            row["different"] = tag_01.get("value") != tag_02.get("value")
-
-            comparison.append(row)
+            comparison.append(self._build_row(base_record, tag_key, d1_dict.get(tag_key), dicom_01_label,
+                                              d2_dict.get(tag_key), dicom_02_label))
 
         return comparison
+
+    def iter_differences(self, base_record, dicom_01, dicom_01_label, dicom_02, dicom_02_label):
+        """Yield only the rows whose values differ, in tag path order.
+
+        Pairs whose meta and header digests match yield nothing without
+        being parsed, and rows are only built for differing tags, so the
+        cost follows the number of differences.
+        """
+        if self.is_identical(dicom_01, dicom_02):
+            return
+
+        d1_dict = dicom_01.meta_dict | dicom_01.header_dict if dicom_01.exists else {}
+        d2_dict = dicom_02.meta_dict | dicom_02.header_dict if dicom_02.exists else {}
+
+        different = [tag_key for tag_key, tag_01 in d1_dict.items()
+                     if tag_key not in d2_dict or tag_01.value != d2_dict[tag_key].value]
+        different.extend(tag_key for tag_key in d2_dict if tag_key not in d1_dict)
+
+        for tag_key in sorted(different):
+            yield self._build_row(base_record, tag_key, d1_dict.get(tag_key), dicom_01_label,
+                                  d2_dict.get(tag_key), dicom_02_label)
+
+    def is_identical(self, dicom_01, dicom_02):
+        """True when both files exist and their meta and header digests match."""
+        return (dicom_01.exists and dicom_02.exists
+                and dicom_01.digest_algorithm == dicom_02.digest_algorithm
+                and dicom_01.meta_digest is not None and dicom_01.header_digest is not None
+                and dicom_01.meta_digest == dicom_02.meta_digest
+                and dicom_01.header_digest == dicom_02.header_digest)
+
+    def _build_row(self, base_record, tag_key, tag_01, dicom_01_label, tag_02, dicom_02_label):
+        row = base_record.copy()
+        record = tag_01 or tag_02
+
+        row["tag"] = record.label
+        row["tag_path"] = tag_key
+
+        row["tag_group"] = record.group
+        row["tag_element"] = record.element
+        row["tag_name"] = record.name
+        row["tag_keyword"] = record.keyword
+        row["tag_vr"] = record.vr
+        row["tag_vm"] = record.vm
+        row["is_private"] = record.is_private
+        row["private_creator"] = record.private_creator
+
+        value_01 = tag_01.value if tag_01 else None
+        value_02 = tag_02.value if tag_02 else None
+
+        row[f"{dicom_01_label}_value"] = value_01 if not row["tag_vr"] == "SQ" else "<REMOVED>"
+        row[f"{dicom_02_label}_value"] = value_02 if not row["tag_vr"] == "SQ" else "<REMOVED>"
+        row["different"] = value_01 != value_02
+
+        return row
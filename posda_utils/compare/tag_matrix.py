@@ -1,29 +1,55 @@
 import pandas as pd
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import multiprocessing
 import logging
-from sqlalchemy import Table, Column, MetaData, Text, text, bindparam
+from sqlalchemy import Table, Column, MetaData, Text, text, bindparam, inspect, delete
 import pyarrow as pa
 
 from posda_utils.io.reader import DicomFile
+from posda_utils.db.database import DBManager
+from posda_utils.db.models import DicomIndex, TagMatrixState
+from posda_utils.compare.columnar import explode_files, load_elements, build_tag_matrix
 
 logger = logging.getLogger(__name__)
 
-def build_dicomfile(row):
+ENGINES = ("python", "columnar", "elements")
+
+# State of a pipelined build worker, set once per process by _init_pipeline_worker
+_pipeline = {}
+
+def build_dicomfile(row, parse_cache=None):
     dcm = DicomFile()
-    pixel_data = row.get("pixel_data")
-    dcm.from_json(row["meta_data"], row["header_data"], pixel_data, row)
+    # Rows indexed with a JsonCodec hold their JSON in the packed columns
+    meta = row["meta_data"] if row.get("meta_data") is not None else row.get("meta_packed")
+    header = row["header_data"] if row.get("header_data") is not None else row.get("header_packed")
+    dcm.from_json(meta, header, None, row,
+                  pixel_digest=row.get("pixel_digest"), pixel_size=row.get("pixel_size"),
+                  parse_cache=parse_cache)
     dcm._combined_dict = dcm.meta_dict | dcm.header_dict
     return row["sop_instance_uid"], dcm
 
-def process_batch(ref_uids, label_to_rows):
+def load_group_files(label_to_rows, parse_cache=None):
     group_data_batches = {}
     for label, rows in label_to_rows.items():
         with ThreadPoolExecutor() as tpool:
-            futures = [tpool.submit(build_dicomfile, row) for row in rows]
+            futures = [tpool.submit(build_dicomfile, row, parse_cache) for row in rows]
             dcm_dict = {uid: dcm for uid, dcm in (f.result() for f in as_completed(futures))}
             group_data_batches[label] = dcm_dict
+    return group_data_batches
+
+def process_batch_columnar(ref_uids, label_to_rows, parse_cache=None):
+    """Same rows as process_batch, built by exploding each group to long format and outer-joining."""
+    group_data_batches = load_group_files(label_to_rows, parse_cache)
+    ref_uids = set(ref_uids)
+    frames = {
+        label: explode_files((uid, dcm) for uid, dcm in dcm_dict.items() if uid in ref_uids)
+        for label, dcm_dict in group_data_batches.items()
+    }
+    return build_tag_matrix(frames)
+
+def process_batch(ref_uids, label_to_rows, parse_cache=None):
+    group_data_batches = load_group_files(label_to_rows, parse_cache)
 
     results = []
     for ref_uid in ref_uids:
@@ -51,22 +77,61 @@ def process_batch(ref_uids, label_to_rows):
                 row[f"{label}_value"] = None
 
             for label, tag_dict in tag_data.items():
-                tag_info = tag_dict.get(tag, {})
-                element = tag_info.get("element", None)
-                value = "<REMOVED>" if element and hasattr(element, "VR") and getattr(element, "VR", None) == "SQ" else tag_info.get("value")
-                row[f"{label}_value"] = value
+                record = tag_dict.get(tag)
+                if record is None:
+                    continue
+                row[f"{label}_value"] = "<REMOVED>" if record.vr == "SQ" else record.value
 
                 if row["tag"] is None:
-                    row["tag"] = tag_info.get("label")
-                    element = tag_info.get("element")
-                    row["tag_name"] = getattr(element, "name", None) if element else None
-                    row["tag_vm"] = getattr(element, "VM", None) if element else None
-                    row["tag_vr"] = getattr(element, "VR", None) if element else None
+                    row["tag"] = record.label
+                    row["tag_name"] = record.name
+                    row["tag_vm"] = record.vm
+                    row["tag_vr"] = record.vr
 
             results.append(row)
 
     return results
 
+def matrix_columns(groups):
+    return ["sop_uid", "tag_path", "tag", "tag_name", "tag_vm", "tag_vr"] + [f"{g}_value" for g in groups]
+
+def fetch_label_rows(db_manager, groups, batch):
+    label_to_rows = {}
+    query = text("""
+        SELECT sop_instance_uid, header_data, meta_data, header_packed, meta_packed, pixel_digest, pixel_size
+        FROM dicom_index
+        WHERE group_name = :group AND sop_instance_uid IN :uids
+    """).bindparams(bindparam('uids', expanding=True))
+    for label in groups:
+        params = {"group": label, "uids": list(set(batch))}
+        df = db_manager.run_query(query, df=True, params=params)
+        if df is None:
+            # run_query already logged the error; an empty group would be recorded as built
+            raise RuntimeError(f"Failed to fetch rows of group '{label}'")
+        #label_to_rows[label] = df.to_dict(orient="records")
+        label_to_rows[label] = pa.Table.from_pandas(df).to_pylist()
+    return label_to_rows
+
+def build_batch(db_manager, groups, batch, engine="python", parse_cache=None):
+    """Fetch one UID batch of all groups and return its tag matrix rows."""
+    if engine == "elements":
+        return build_tag_matrix({label: load_elements(db_manager, label, uids=batch) for label in groups})
+    batch_func = process_batch_columnar if engine == "columnar" else process_batch
+    return batch_func(batch, fetch_label_rows(db_manager, groups, batch), parse_cache)
+
+def _init_pipeline_worker(conn_string, groups, table_name, engine, parse_cache):
+    # Each worker owns its engine; connections are never shared across processes
+    table = Table(table_name, MetaData(), *[Column(c, Text, nullable=True) for c in matrix_columns(groups)])
+    _pipeline.update(db=DBManager(conn_string, use_single_session=False), groups=groups, table=table,
+                     engine=engine, parse_cache=parse_cache)
+
+def _pipeline_batch(batch):
+    """Fetch, build and write one batch inside a pipelined worker, return the number of rows written."""
+    db = _pipeline["db"]
+    rows = build_batch(db, _pipeline["groups"], batch, _pipeline["engine"], _pipeline["parse_cache"])
+    db.bulk_load(_pipeline["table"], rows)
+    return len(rows)
+
 class TagMatrixBuilder:
     def __init__(self, db_manager, groups, uid_maps=None):
         self.db = db_manager
@@ -82,7 +147,24 @@ class TagMatrixBuilder:
                      table_name="tag_matrix", 
                      overwrite=True,
                      multiproc=True,
-                     batch_of_batches=None):
+                     batch_of_batches=None,
+                     engine="python",
+                     parse_cache=None,
+                     pipelined=False,
+                     max_in_flight=None,
+                     incremental=False):
+        """Build the tag matrix of all groups into table_name.
+
+        engine is "python", "columnar" or "elements" (reads dicom_element, so
+        DS/IS values keep their file text). parse_cache is a ParseCache.
+        pipelined keeps one pool whose workers fetch, build and write, with at
+        most max_in_flight (default 2 * cpus) batches queued. incremental
+        rebuilds only UIDs whose digests changed since the last recorded build.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}, got '{engine}'")
+        # Tables indexed by older versions lack the packed columns fetch_label_rows selects
+        self.db.create_table_from_model(DicomIndex)
         self._load_uids_from_db()
         cpus = cpus or multiprocessing.cpu_count()
         batch_of_batches = batch_of_batches or cpus
@@ -92,7 +174,11 @@ class TagMatrixBuilder:
             all_uids.update(self.label_to_uids[group])
         all_ref_uids = sorted(all_uids)
 
-        if overwrite:
+        changed_uids = self._changed_uids(table_name) if incremental else None
+        if changed_uids is not None:
+            logger.info(f"Incremental build of '{table_name}': {len(changed_uids)} changed UIDs.")
+            all_ref_uids = sorted(changed_uids & all_uids)
+        elif overwrite or incremental:
             try:
                 self.db.session.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
                 self.db.session.commit()
@@ -102,69 +188,173 @@ class TagMatrixBuilder:
                 logger.error(f"Failed to drop table '{table_name}': {e}")
 
         self._prepare_tag_table(table_name)
+        if changed_uids:
+            self._delete_matrix_rows(changed_uids)
 
+        self._failed_uids = set()
         batches = self._batch_uids(all_ref_uids, batch_size)
 
-        def fetch_label_rows(batch):
-            label_to_rows = {}
-            for label in self.groups:
-                batch_uids = set(batch)
-                query = text("""
-                    SELECT sop_instance_uid, header_data, meta_data, pixel_data FROM dicom_index 
-                    WHERE group_name = :group AND sop_instance_uid IN :uids
-                """).bindparams(bindparam('uids', expanding=True))
-                params = {"group": label, "uids": list(batch_uids)}
-                df = self.db.run_query(query, df=True, params=params)
-                #label_to_rows[label] = df.to_dict(orient="records") if df is not None else []
-                label_to_rows[label] = pa.Table.from_pandas(df).to_pylist() if df is not None else []
-            return label_to_rows
-
-        if multiproc:
+        if pipelined:
+            self._build_pipelined(batches, table_name, engine, parse_cache, cpus, max_in_flight or 2 * cpus)
+        elif multiproc and engine != "elements":
+            batch_func = process_batch_columnar if engine == "columnar" else process_batch
             for i in range(0, len(batches), batch_of_batches):
                 chunk = batches[i:i + batch_of_batches]
                 with ProcessPoolExecutor(max_workers=cpus) as executor:
-                    future_to_batch = {
-                        executor.submit(process_batch, batch, fetch_label_rows(batch)): batch
-                        for batch in chunk
-                    }
+                    future_to_batch = {}
+                    for batch in chunk:
+                        try:
+                            future_to_batch[executor.submit(batch_func, batch, fetch_label_rows(self.db, self.groups, batch), parse_cache)] = batch
+                        except Exception as e:
+                            self._failed_uids.update(batch)
+                            logger.error(f"Failed to fetch batch: {e}")
 
                     for future in tqdm(as_completed(future_to_batch), total=len(future_to_batch), desc=f"Processing batches {i}-{i+len(chunk)} of {len(batches)}"):
                         try:
                             rows = future.result()
-                            self._write_batch_to_db(rows)
+                            if not self._write_batch_to_db(rows):
+                                self._failed_uids.update(future_to_batch[future])
                         except Exception as e:
+                            self._failed_uids.update(future_to_batch[future])
                             logger.error(f"Failed to process batch in parallel: {e}")
         else:
             for batch in tqdm(batches, desc="Building Tag Matrix"):
                 try:
-                    label_to_rows = fetch_label_rows(batch)
-                    rows = process_batch(batch, label_to_rows)
-                    self._write_batch_to_db(rows)
+                    rows = build_batch(self.db, self.groups, batch, engine, parse_cache)
+                    if not self._write_batch_to_db(rows):
+                        self._failed_uids.update(batch)
                 except Exception as e:
+                    self._failed_uids.update(batch)
                     logger.error(f"Failed to process batch: {e}")
+            if parse_cache is not None:
+                logger.info(f"Parse cache: {parse_cache.stats()}")
+
+        if overwrite or incremental:
+            self._save_state(table_name, changed_uids)
+        else:
+            self._clear_state(table_name)
+
+    def _build_pipelined(self, batches, table_name, engine, parse_cache, cpus, max_in_flight):
+        initargs = (self.db.conn_string, self.groups, table_name, engine, parse_cache)
+        written = 0
+        with ProcessPoolExecutor(max_workers=cpus, initializer=_init_pipeline_worker, initargs=initargs) as executor, \
+                tqdm(total=len(batches), desc="Building Tag Matrix") as progress:
+            in_flight = {}
+
+            def collect(done):
+                nonlocal written
+                for future in done:
+                    batch = in_flight.pop(future)
+                    progress.update()
+                    try:
+                        written += future.result()
+                    except Exception as e:
+                        self._failed_uids.update(batch)
+                        logger.error(f"Failed to process batch in pipeline: {e}")
+
+            for batch in batches:
+                in_flight[executor.submit(_pipeline_batch, batch)] = batch
+                if len(in_flight) >= max_in_flight:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED)[0])
+            collect(wait(in_flight)[0])
+        logger.info(f"Wrote {written} rows to '{table_name}'.")
 
     def _prepare_tag_table(self, table_name):
         metadata = MetaData()
-        sample_cols = ["sop_uid", "tag_path", "tag", "tag_name", "tag_vm", "tag_vr"] + [f"{g}_value" for g in self.groups]
-        columns = [Column(c, Text, nullable=True) for c in sample_cols]
+        columns = [Column(c, Text, nullable=True) for c in matrix_columns(self.groups)]
         self._tag_table = Table(table_name, metadata, *columns)
         self._tag_table.create(self.db.engine, checkfirst=True)
         logger.info(f"Created table '{table_name}'.")
 
     def _write_batch_to_db(self, rows):
         try:
-            with self.db.engine.begin() as conn:
-                conn.execute(self._tag_table.insert(), rows)
+            self.db.bulk_load(self._tag_table, rows)
+            return True
         except Exception as e:
             logger.error(f"Failed to insert batch: {e}")
+            return False
 
     def _batch_uids(self, uid_list, batch_size):
         return [uid_list[i:i + batch_size] for i in range(0, len(uid_list), batch_size)]
 
     def _load_uids_from_db(self):
+        """Load the UIDs of each group, and the (meta, header) digests per (group, UID) for the build state."""
         logger.info("Load the UIDs for each group")
         self.label_to_uids = {}
+        digests = {}
         for group in self.groups:
-            query = "SELECT sop_instance_uid FROM dicom_index WHERE group_name = :group"
-            df = self.db.run_query(query, df=True, params={"group": group})
-            self.label_to_uids[group] = set(df["sop_instance_uid"])
+            uids = set()
+            for rows in self.db.iter_query(DicomIndex, params={"group_name": group},
+                                           columns=["sop_instance_uid", "meta_digest", "header_digest"]):
+                for row in rows:
+                    if row.sop_instance_uid is None:
+                        continue
+                    uids.add(row.sop_instance_uid)
+                    digests.setdefault((group, row.sop_instance_uid), []).append((row.meta_digest or "", row.header_digest or ""))
+            self.label_to_uids[group] = uids
+
+        # A UID indexed from several files keeps all their digests, in a stable order
+        self.uid_digests = {}
+        for key, pairs in digests.items():
+            metas, headers = zip(*sorted(pairs))
+            self.uid_digests[key] = (",".join(metas), ",".join(headers))
+
+    def _changed_uids(self, table_name):
+        """UIDs whose digests differ from the recorded build state, or None if a full build is needed."""
+        self.db.create_table_from_model(TagMatrixState)
+        inspector = inspect(self.db.engine)
+        if not inspector.has_table(table_name):
+            return None
+        if [c["name"] for c in inspector.get_columns(table_name)] != matrix_columns(self.groups):
+            logger.info(f"Groups of '{table_name}' changed, rebuilding it.")
+            return None
+
+        previous = {}
+        for rows in self.db.iter_query(TagMatrixState, params={"table_name": table_name},
+                                       columns=["group_name", "sop_instance_uid", "meta_digest", "header_digest"]):
+            for row in rows:
+                previous[(row.group_name, row.sop_instance_uid)] = (row.meta_digest, row.header_digest)
+        if not previous:
+            return None
+
+        return {uid for (group, uid) in previous.keys() | self.uid_digests.keys()
+                if previous.get((group, uid)) != self.uid_digests.get((group, uid))}
+
+    def _delete_matrix_rows(self, uids, chunk_size=500):
+        uids = sorted(uids)
+        with self.db.engine.begin() as conn:
+            for i in range(0, len(uids), chunk_size):
+                conn.execute(delete(self._tag_table).where(self._tag_table.c.sop_uid.in_(uids[i:i + chunk_size])))
+
+    def _save_state(self, table_name, changed_uids=None, chunk_size=500):
+        """Record the digests the matrix was built from; with changed_uids only those UIDs are replaced.
+
+        UIDs of failed batches get no state, so the next incremental build retries them.
+        """
+        self.db.create_table_from_model(TagMatrixState)
+        state = TagMatrixState.__table__
+        rows = [
+            {"table_name": table_name, "group_name": group, "sop_instance_uid": uid,
+             "meta_digest": meta_digest, "header_digest": header_digest}
+            for (group, uid), (meta_digest, header_digest) in self.uid_digests.items()
+            if uid not in self._failed_uids and (changed_uids is None or uid in changed_uids)
+        ]
+        try:
+            with self.db.engine.begin() as conn:
+                if changed_uids is None:
+                    conn.execute(delete(state).where(state.c.table_name == table_name))
+                else:
+                    uids = sorted(changed_uids)
+                    for i in range(0, len(uids), chunk_size):
+                        conn.execute(delete(state).where(state.c.table_name == table_name,
+                                                         state.c.sop_instance_uid.in_(uids[i:i + chunk_size])))
+                self.db.bulk_load(state, rows, conn=conn)
+            logger.info(f"Recorded build state of {len(rows)} UIDs for '{table_name}'.")
+        except Exception as e:
+            logger.error(f"Failed to record build state of '{table_name}': {e}")
+
+    def _clear_state(self, table_name):
+        state = TagMatrixState.__table__
+        if inspect(self.db.engine).has_table(state.name):
+            with self.db.engine.begin() as conn:
+                conn.execute(delete(state).where(state.c.table_name == table_name))
@@ -3,10 +3,13 @@
 import logging
 import pandas as pd
 from contextlib import contextmanager
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import create_engine, text, inspect, or_, and_, select, delete, Table, String, LargeBinary
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import Select
 from sqlalchemy.exc import SQLAlchemyError
 import io
+import sqlite3
 import psycopg2
 from psycopg2.extras import execute_values
 from posda_utils.db.models import Base
@@ -17,6 +20,25 @@ from posda_utils.db.models import Base
 
 logger = logging.getLogger(__name__)
 
+# SQLITE_MAX_VARIABLE_NUMBER defaults to 999 before SQLite 3.32
+SQLITE_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+# COPY text format escapes, see https://www.postgresql.org/docs/current/sql-copy.html
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, float) and value != value:
+        return "\\N"
+    return str(value).translate(_COPY_ESCAPES)
+
+
 class DBManager:
     def __init__(self, conn_string, echo=False, use_single_session=True):
         self.conn_string = conn_string
@@ -65,6 +87,49 @@ class DBManager:
                 logger.info(f"Table '{table_name}' created.")
             except SQLAlchemyError as e:
                 logger.error(f"Failed to create table '{table_name}': {e}")
+        else:
+            # Tables created by an older model may lack columns and indexes added since
+            self._upgrade_columns(model.__table__, inspector)
+            for index in model.__table__.indexes:
+                try:
+                    index.create(bind=self.engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    logger.error(f"Failed to create index '{index.name}': {e}")
+                    if index.unique:
+                        columns = ", ".join(c.name for c in index.columns)
+                        raise RuntimeError(
+                            f"Cannot create unique index '{index.name}' on '{table_name}' ({columns}), "
+                            f"most likely the table holds duplicate rows for that key. Delete the duplicates "
+                            f"and retry.") from e
+
+    def _upgrade_columns(self, table, inspector):
+        """Add the model's missing columns to an existing table and convert retired text columns to binary.
+
+        Added columns are nullable, rows written before keep NULL there. Old
+        pixel_data text columns hold base64, PostgreSQL converts them in place;
+        SQLite stores either type in the column, and the readers accept both.
+        """
+        preparer = self.engine.dialect.identifier_preparer
+        dialect = self.engine.dialect.name
+        existing = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+
+        with self.engine.begin() as conn:
+            for column in table.columns:
+                name = preparer.quote(column.name)
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                if column.name not in existing:
+                    if not column.nullable:
+                        raise RuntimeError(f"Cannot add NOT NULL column '{column.name}' to existing table '{table.name}'.")
+                    conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {name} {column_type}"))
+                    logger.info(f"Added column '{column.name}' to '{table.name}'.")
+                elif isinstance(column.type, LargeBinary) and isinstance(existing[column.name], String):
+                    if dialect == "postgresql":
+                        conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ALTER COLUMN {name} "
+                                          f"TYPE {column_type} USING decode({name}, 'base64')"))
+                        logger.info(f"Converted column '{column.name}' of '{table.name}' to {column_type}.")
+                    elif dialect != "sqlite":
+                        raise RuntimeError(f"Column '{column.name}' of '{table.name}' is text, but binary data is now "
+                                           f"stored there. Convert it to {column_type}, or recreate the table.")
 
     def run_query(self, query_text, df=False, params=None):
         stmt = text(query_text) if isinstance(query_text, str) else query_text
@@ -77,6 +142,42 @@ class DBManager:
                 logger.error(f"Query failed: {e}. Query: {stmt}, Params: {params}")
                 return None
 
+    def iter_query(self, query_text, params=None, chunk_size=10000, df=False, columns=None):
+        """Yield the results of a query in chunks of chunk_size rows.
+
+        Rows are fetched through a server-side cursor (stream_results), so
+        memory stays bounded by one chunk however large the result is. Chunks
+        are lists of rows, or DataFrames with df. query_text may be SQL, a
+        select(), or a Table/ORM model; for a model, params are equality
+        filters. columns projects the result onto those columns.
+        """
+        table = getattr(query_text, "__table__", query_text)
+        if isinstance(table, Table):
+            selected = [table.c[c] for c in columns] if columns else [table]
+            stmt = select(*selected).where(*[table.c[k] == v for k, v in (params or {}).items()])
+            params = None
+        elif columns and isinstance(query_text, str):
+            projected = ", ".join(self.engine.dialect.identifier_preparer.quote(c) for c in columns)
+            stmt = text(f"SELECT {projected} FROM ({query_text}) AS q")
+        elif columns and isinstance(query_text, Select):
+            subquery = query_text.subquery()
+            stmt = select(*[subquery.c[c] for c in columns])
+        elif columns:
+            raise ValueError("columns needs SQL text, a select() or a Table/ORM model")
+        else:
+            stmt = text(query_text) if isinstance(query_text, str) else query_text
+
+        with self.engine.connect() as conn:
+            try:
+                result = conn.execution_options(stream_results=True, yield_per=chunk_size)\
+                    .execute(stmt, params or {})
+                keys = list(result.keys())
+                for rows in result.partitions(chunk_size):
+                    yield pd.DataFrame(rows, columns=keys) if df else rows
+            except SQLAlchemyError as e:
+                logger.error(f"Streaming query failed: {e}. Query: {stmt}, Params: {params}")
+                raise
+
     def run_write(self, query_text, data_dict):
         stmt = text(query_text) if isinstance(query_text, str) else query_text
         with self._get_session() as session:
@@ -108,6 +209,124 @@ class DBManager:
             except SQLAlchemyError as e:
                 logger.error(f"Truncate failed: {e}. Query: {query}")
 
+    def bulk_load(self, table, rows, batch_size=1000, conn=None):
+        """Load rows into table in one transaction, using the fastest path for the dialect.
+
+        PostgreSQL streams the rows through COPY, SQLite uses a plain
+        executemany with WAL and synchronous=NORMAL, MySQL and others send
+        multi-row INSERTs of batch_size rows. table may be a Table or an ORM
+        model, rows a list of dicts or a DataFrame. Only columns present in
+        the first row are loaded. Runs in conn's transaction when given.
+        Returns the number of rows loaded.
+        """
+        table = getattr(table, "__table__", table)
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.astype(object).where(rows.notna(), None).to_dict(orient="records")
+        if not rows:
+            return 0
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.bulk_load(table, rows, batch_size, conn)
+
+        columns = [c.name for c in table.columns if c.name in rows[0]]
+        dialect = self.engine.dialect.name
+        try:
+            if dialect == "postgresql":
+                self._copy_rows(conn, table, columns, rows)
+            elif dialect == "sqlite":
+                self._executemany_rows(conn, table, columns, rows)
+            else:
+                for i in range(0, len(rows), batch_size):
+                    batch = [{c: row.get(c) for c in columns} for row in rows[i:i + batch_size]]
+                    conn.execute(table.insert().values(batch))
+        except Exception as e:
+            logger.error(f"Bulk load into '{table.name}' failed: {e}")
+            raise
+        return len(rows)
+
+    def bulk_upsert(self, table, rows, key_columns, compare_columns=None, batch_size=1000, conn=None):
+        """Insert rows, updating the existing row where key_columns already match.
+
+        Uses ON CONFLICT on PostgreSQL and SQLite, which needs a unique index
+        on key_columns, and ON DUPLICATE KEY on MySQL. With compare_columns,
+        a conflicting row is only rewritten when one of those columns differs,
+        so unchanged rows are not touched (MySQL skips identical rows itself).
+        Other dialects delete the rows with matching keys and bulk_load them
+        again. Runs in one transaction, or in conn's when given. Returns the
+        number of rows offered.
+        """
+        table = getattr(table, "__table__", table)
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.astype(object).where(rows.notna(), None).to_dict(orient="records")
+        if not rows:
+            return 0
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.bulk_upsert(table, rows, key_columns, compare_columns, batch_size, conn)
+
+        columns = [c.name for c in table.columns if c.name in rows[0]]
+        update_columns = [c for c in columns if c not in key_columns]
+        compare_columns = [c for c in compare_columns or [] if c in columns]
+        dialect = self.engine.dialect.name
+        if dialect == "sqlite":
+            batch_size = max(1, min(batch_size, SQLITE_MAX_VARIABLES // len(columns)))
+
+        try:
+            for i in range(0, len(rows), batch_size):
+                batch = [{c: row.get(c) for c in columns} for row in rows[i:i + batch_size]]
+                if dialect in ("postgresql", "sqlite"):
+                    insert = (postgresql if dialect == "postgresql" else sqlite).insert(table).values(batch)
+                    changed = or_(*[table.c[c].is_distinct_from(insert.excluded[c]) for c in compare_columns])
+                    stmt = insert.on_conflict_do_update(
+                        index_elements=key_columns,
+                        set_={c: insert.excluded[c] for c in update_columns},
+                        where=changed if compare_columns else None
+                    )
+                elif dialect in ("mysql", "mariadb"):
+                    insert = mysql.insert(table).values(batch)
+                    stmt = insert.on_duplicate_key_update({c: insert.inserted[c] for c in update_columns})
+                else:
+                    self._replace_rows(conn, table, key_columns, batch)
+                    continue
+                conn.execute(stmt)
+        except Exception as e:
+            logger.error(f"Bulk upsert into '{table.name}' failed: {e}")
+            raise
+        return len(rows)
+
+    def _replace_rows(self, conn, table, key_columns, rows, chunk_size=100):
+        for i in range(0, len(rows), chunk_size):
+            keys = [and_(*[table.c[k].is_(None) if row[k] is None else table.c[k] == row[k] for k in key_columns])
+                    for row in rows[i:i + chunk_size]]
+            conn.execute(delete(table).where(or_(*keys)))
+        self.bulk_load(table, rows, conn=conn)
+
+    def _copy_rows(self, conn, table, columns, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join([_copy_value(row.get(c)) for c in columns]))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        preparer = self.engine.dialect.identifier_preparer
+        column_list = ", ".join(preparer.quote(c) for c in columns)
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {preparer.format_table(table)} ({column_list}) FROM STDIN", buffer)
+
+    def _executemany_rows(self, conn, table, columns, rows):
+        # Neither pragma can change inside a transaction, so only set them when the load opens one
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
+
+        preparer = self.engine.dialect.identifier_preparer
+        column_list = ", ".join(preparer.quote(c) for c in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        conn.exec_driver_sql(
+            f"INSERT INTO {preparer.format_table(table)} ({column_list}) VALUES ({placeholders})",
+            [tuple(row.get(c) for c in columns) for row in rows]
+        )
+
     def bulk_insert(self, df, table, schema="public", if_exists="append", index=False):
         if df.empty:
             return
@@ -1,5 +1,6 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, BigInteger, Integer, String, Text, Index, Boolean
+from sqlalchemy import Column, BigInteger, Integer, String, Text, Index, Boolean, LargeBinary
+from sqlalchemy.dialects.mysql import LONGBLOB
 
 Base = declarative_base()
 
@@ -11,6 +12,9 @@ class DicomIndex(Base):
     group_name = Column(String)
 
     file_path = Column(String)
+    file_digest = Column(String, nullable=True)
+    file_size = Column(BigInteger, nullable=True)
+    digest_algorithm = Column(String, nullable=True)
     
     sop_class_uid = Column(String)
     modality = Column(String)
@@ -20,22 +24,106 @@ class DicomIndex(Base):
     sop_instance_uid = Column(String)
     
     header_data = Column(Text)
+    header_packed = Column(LargeBinary().with_variant(LONGBLOB, "mysql"), nullable=True)
     header_digest = Column(String)
     header_size = Column(BigInteger)
     
     meta_data = Column(Text)
+    meta_packed = Column(LargeBinary().with_variant(LONGBLOB, "mysql"), nullable=True)
     meta_digest = Column(String)
     meta_size = Column(BigInteger)
     
-    pixel_data = Column(Text, nullable=True)
+    pixel_data = Column(LargeBinary().with_variant(LONGBLOB, "mysql"), nullable=True)
     pixel_digest = Column(String, nullable=True)
     pixel_size = Column(BigInteger, nullable=True)
     
     __table_args__ = (
-        Index("idx_dicom_group_uid", "group_name", "sop_instance_uid"),
+        # Upsert key, also serves lookups by group and SOP instance UID
+        Index("uq_dicom_group_uid_path", "group_name", "sop_instance_uid", "file_path", unique=True),
+        Index("idx_dicom_group_path", "group_name", "file_path"),
+    )
+
+
+class DicomIndexSeen(Base):
+    """Keys written by a streaming index run, staged so stale rows can be found without holding them in memory."""
+    __tablename__ = "dicom_index_seen"
+
+    seen_id = Column(Integer, primary_key=True, autoincrement=True)
+
+    run_id = Column(String)
+    sop_instance_uid = Column(String)
+    file_path = Column(String)
+
+    __table_args__ = (
+        Index("idx_seen_run_path", "run_id", "file_path"),
+    )
+
+
+class DicomElement(Base):
+    __tablename__ = "dicom_element"
+
+    element_id = Column(Integer, primary_key=True, autoincrement=True)
+
+    group_name = Column(String)
+    file_path = Column(String)
+    sop_instance_uid = Column(String)
+
+    tag = Column(String)
+    tag_path = Column(String)
+
+    tag_group = Column(Integer)
+    tag_element = Column(Integer)
+    tag_name = Column(String)
+    tag_keyword = Column(String)
+    tag_vr = Column(String)
+    tag_vm = Column(Integer)
+    is_private = Column(Boolean)
+    private_creator = Column(String)
+
+    value = Column(Text)
+
+    __table_args__ = (
+        Index("idx_element_group_tag", "group_name", "tag_path"),
+        Index("idx_element_uid_tag", "sop_instance_uid", "tag_path"),
+        Index("idx_element_group_path", "group_name", "file_path"),
+    )
+
+
+class FileManifest(Base):
+    __tablename__ = "file_manifest"
+
+    manifest_id = Column(Integer, primary_key=True, autoincrement=True)
+
+    group_name = Column(String)
+
+    file_path = Column(String)
+    file_size = Column(BigInteger)
+    file_mtime = Column(BigInteger)
+    file_inode = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index("idx_manifest_group_path", "group_name", "file_path"),
     )
     
 
+class TagMatrixState(Base):
+    __tablename__ = "tag_matrix_state"
+
+    state_id = Column(Integer, primary_key=True, autoincrement=True)
+
+    table_name = Column(String)
+    group_name = Column(String)
+    sop_instance_uid = Column(String)
+
+    # Digests of the dicom_index rows the matrix rows were built from, comma-joined when a UID has several files
+    meta_digest = Column(Text)
+    header_digest = Column(Text)
+
+    __table_args__ = (
+        Index("uq_state_table_group_uid", "table_name", "group_name", "sop_instance_uid", unique=True),
+    )
+
+
 class DicomCompare(Base):
     __tablename__ = "dicom_compare"
 
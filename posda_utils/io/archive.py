@@ -0,0 +1,62 @@
+# posda_utils/io/archive.py
+
+import logging
+import tarfile
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SEPARATOR = "!"
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError)
+
+
+def is_archive(path):
+    """Check whether path names a zip or tar archive, by its suffix."""
+    return is_zip(path) or is_tar(path)
+
+
+def is_zip(path):
+    return path.lower().endswith(ZIP_SUFFIXES)
+
+
+def is_tar(path):
+    return path.lower().endswith(TAR_SUFFIXES)
+
+
+def member_path(archive_path, member_name):
+    """Return the file_path recorded for an archive member, 'archive!member'."""
+    return f"{archive_path}{ARCHIVE_SEPARATOR}{member_name}"
+
+
+def iter_zip_members(archive_path):
+    """Yield (name, uncompressed size) for the regular files in a zip archive."""
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size
+
+
+def read_zip_members(archive_path, member_names):
+    """Yield (name, bytes) for the given members, opening the archive once."""
+    with zipfile.ZipFile(archive_path) as archive:
+        for name in member_names:
+            try:
+                yield name, archive.read(name)
+            except (KeyError, zipfile.BadZipFile, OSError) as e:
+                logger.error(f"Cannot read {member_path(archive_path, name)}: {e}")
+
+
+def iter_tar_members(archive_path):
+    """Yield (name, bytes) for the regular files in a tar archive.
+
+    The archive is read as a forward-only stream, so compressed tars are
+    decompressed exactly once, and only one member is held at a time.
+    """
+    with tarfile.open(archive_path, "r|*") as archive:
+        for info in archive:
+            if not info.isfile():
+                continue
+            member = archive.extractfile(info)
+            yield info.name, member.read()
@@ -0,0 +1,153 @@
+# posda_utils/io/cache.py
+
+import os
+import sys
+import pickle
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# One cache per configuration and process, see get_parse_cache
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_parse_cache(max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+    """Return this process's ParseCache for the given configuration, creating it on first use."""
+    key = (max_bytes, cache_dir)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ParseCache(max_bytes, cache_dir)
+        return _caches[key]
+
+
+def estimate_size(tag_dict):
+    """Approximate memory held by a tag dictionary of ElementRecords."""
+    size = sys.getsizeof(tag_dict)
+    for tag_path, record in tag_dict.items():
+        size += sys.getsizeof(tag_path) + sys.getsizeof(record) + sys.getsizeof(record.value)
+    return size
+
+
+class ParseCache:
+    """Bounded LRU of parsed tag dictionaries, keyed by (digest algorithm, JSON digest).
+
+    Entries are evicted least recently used first once their estimated size
+    passes max_bytes. With cache_dir, entries are also pickled to disk, so a
+    later run over the same rows skips parsing too; the directory is not
+    bounded. Cached dictionaries are shared, callers must not modify them.
+
+    Pickling a ParseCache, e.g. to send it to a pool worker, only carries its
+    configuration: the worker uses its own process cache (get_parse_cache),
+    so hit/miss counters are per process.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __reduce__(self):
+        return get_parse_cache, (self.max_bytes, self.cache_dir)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, algorithm, digest):
+        """Return the cached tag dictionary, or None on a miss."""
+        key = (algorithm, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        tag_dict = self._read_disk(key) if self.cache_dir else None
+        with self._lock:
+            if tag_dict is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._store(key, tag_dict)
+        return tag_dict
+
+    def put(self, algorithm, digest, tag_dict):
+        key = (algorithm, digest)
+        self._store(key, tag_dict)
+        if self.cache_dir:
+            self._write_disk(key, tag_dict)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        """Empty the in-memory entries, the disk entries are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key, tag_dict):
+        entry_size = estimate_size(tag_dict)
+        if entry_size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (tag_dict, entry_size)
+            self.size += entry_size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def _disk_path(self, key):
+        algorithm, digest = key
+        return os.path.join(self.cache_dir, digest[:2], f"{algorithm}-{digest}.pkl")
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable parse cache entry {path}: {e}")
+            return None
+
+    def _write_disk(self, key, tag_dict):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written under a temporary name and renamed, so concurrent workers never read a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(tag_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write parse cache entry {path}: {e}")
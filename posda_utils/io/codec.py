@@ -0,0 +1,98 @@
+# posda_utils/io/codec.py
+
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DEFAULT_LEVEL = 3
+DEFAULT_DICT_SIZE = 112640
+
+# Trained dictionaries by zstd dictionary ID, used to decompress frames that name one
+_dictionaries = {}
+# Decompressors are not safe for concurrent use, keep one per thread and dictionary
+_local = threading.local()
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compression needs the zstandard package: pip install posda_utils[zstd]")
+
+
+def register_dictionary(dict_data):
+    """Make a trained dictionary available for decompression, return its ID."""
+    _require_zstandard()
+    dictionary = zstandard.ZstdCompressionDict(bytes(dict_data))
+    _dictionaries[dictionary.dict_id()] = dictionary
+    return dictionary.dict_id()
+
+
+def train_dictionary(samples, dict_size=DEFAULT_DICT_SIZE):
+    """Train a zstd dictionary on sample JSON documents, return its bytes.
+
+    Headers of one collection share most of their keys and many values, so
+    a dictionary trained on a few hundred of them compresses small rows far
+    better than zstd alone.
+    """
+    _require_zstandard()
+    samples = [s.encode("utf-8") if isinstance(s, str) else bytes(s) for s in samples if s is not None]
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+class JsonCodec:
+    """zstd compression of header and meta JSON for the binary index columns.
+
+    Picklable, so it can travel to indexing workers; the compressor itself
+    is built lazily in each process.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, dictionary=None):
+        _require_zstandard()
+        self.level = level
+        self.dictionary = bytes(dictionary) if dictionary is not None else None
+        self._compressor = None
+
+    def __getstate__(self):
+        return {"level": self.level, "dictionary": self.dictionary, "_compressor": None}
+
+    def compress(self, json_text):
+        if json_text is None:
+            return None
+        if self._compressor is None:
+            dict_data = None
+            if self.dictionary is not None:
+                register_dictionary(self.dictionary)
+                dict_data = zstandard.ZstdCompressionDict(self.dictionary)
+            self._compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data)
+        return self._compressor.compress(json_text.encode("utf-8"))
+
+
+def decompress_json(data):
+    """Return JSON text from a stored value, decompressing zstd frames.
+
+    Text is returned as is, so callers can pass either column.
+    """
+    if data is None or isinstance(data, str):
+        return data
+
+    data = bytes(data)
+    if not data.startswith(ZSTD_MAGIC):
+        return data.decode("utf-8")
+
+    _require_zstandard()
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    if dict_id and dict_id not in _dictionaries:
+        raise ValueError(f"zstd frame needs dictionary {dict_id}, register it with register_dictionary()")
+    return _decompressor(dict_id).decompress(data).decode("utf-8")
+
+
+def _decompressor(dict_id):
+    decompressors = getattr(_local, "decompressors", None)
+    if decompressors is None:
+        decompressors = _local.decompressors = {}
+    if dict_id not in decompressors:
+        decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=_dictionaries.get(dict_id))
+    return decompressors[dict_id]
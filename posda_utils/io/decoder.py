@@ -0,0 +1,68 @@
+# posda_utils/io/decoder.py
+
+from functools import lru_cache
+
+from pydicom.charset import convert_encodings, decode_bytes
+
+from posda_utils.io.hasher import hash_data
+
+BINARY_VRS = frozenset({"OB", "OD", "OF", "OL", "OV", "OW"})
+DEFAULT_ENCODINGS = ("iso8859",)
+
+# Byte values are memoized up to this length; longer values are decoded directly
+MEMO_MAX_BYTES = 1024
+MEMO_SIZE = 8192
+
+# Control bytes that do not occur in text values (ESC is kept for ISO 2022 code extensions)
+_TEXT_BYTES = bytes(range(0x20, 0x7F)) + b"\t\n\r\f\x1b" + bytes(range(0x80, 0x100))
+
+
+def dataset_encodings(dataset, parent_encodings=DEFAULT_ENCODINGS):
+    """Return the Python encodings for a dataset's SpecificCharacterSet.
+
+    Sequence items without their own SpecificCharacterSet inherit the parent's.
+    """
+    charset = dataset.get("SpecificCharacterSet")
+    if not charset:
+        return parent_encodings
+    if isinstance(charset, str):
+        charset = (charset,)
+    return _convert_charset(tuple(charset))
+
+
+def decode_value(value, vr, encodings=DEFAULT_ENCODINGS):
+    """Return a comparable form of an element value.
+
+    Binary VRs are summarized by length and digest, other byte values are
+    decoded with the dataset's character set. UN values are only decoded
+    when they look like text. Anything that is not bytes is returned as is.
+    """
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+
+    value = bytes(value)
+    if len(value) <= MEMO_MAX_BYTES:
+        return _decode_bytes_cached(value, str(vr), encodings)
+    return _decode_bytes(value, str(vr), encodings)
+
+
+def _decode_bytes(value, vr, encodings):
+    if vr not in BINARY_VRS and (vr != "UN" or _is_text(value)):
+        try:
+            return decode_bytes(value, list(encodings), set())
+        except Exception:
+            pass
+    size, digest = hash_data(value)
+    return f"{size} bytes md5:{digest}"
+
+
+_decode_bytes_cached = lru_cache(maxsize=MEMO_SIZE)(_decode_bytes)
+
+
+@lru_cache(maxsize=256)
+def _convert_charset(charset):
+    return tuple(convert_encodings(list(charset)))
+
+
+def _is_text(value):
+    return not value.rstrip(b"\x00").translate(None, _TEXT_BYTES)
@@ -1,28 +1,166 @@
+import os
+import mmap
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-def hash_file(filename, buffer_size = 8192):
-    """Calculate the md5sum of file, return (size, digest)"""
-    file_size = 0
-    file_hash = hashlib.md5()
-    
-    with open(filename, "rb") as f:
-        while (chunk := f.read(buffer_size)):
-            file_hash.update(chunk)
-            file_size += len(chunk)
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# MD5 stays the default, Posda identifies files by their md5sum
+DEFAULT_ALGORITHM = "md5"
+
+HASH_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if blake3:
+    HASH_ALGORITHMS["blake3"] = blake3.blake3
+if xxhash:
+    HASH_ALGORITHMS["xxh3"] = xxhash.xxh3_128
+
+
+def new_hash(algorithm = DEFAULT_ALGORITHM):
+    """Return a new hash object for one of HASH_ALGORITHMS."""
+    try:
+        return HASH_ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unsupported digest algorithm '{algorithm}', available: {sorted(HASH_ALGORITHMS)}") from None
+
+
+def hash_file(filename, buffer_size = 1048576, algorithm = DEFAULT_ALGORITHM, use_mmap = False):
+    """Calculate the digest of file, return (size, digest)
+
+    Reads into a reused buffer, or hashes a memory map of the file with
+    use_mmap. The hash update releases the GIL for large blocks, so files
+    can be hashed concurrently from threads (see hash_files).
+    """
+    file_hash = new_hash(algorithm)
+
+    with open(filename, "rb", buffering=0) as f:
+        if use_mmap:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    for offset in range(0, file_size, buffer_size):
+                        file_hash.update(view[offset:offset + buffer_size])
+            return file_size, file_hash.hexdigest()
+
+        file_size = 0
+        buffer = bytearray(buffer_size)
+        with memoryview(buffer) as view:
+            while (n := f.readinto(buffer)):
+                file_hash.update(view[:n])
+                file_size += n
 
     return file_size, file_hash.hexdigest()
 
 
-def hash_data(data):
-    """Calculate the md5sum of data, return (size, digest)"""
+def hash_files(filenames, max_workers = 8, buffer_size = 1048576, algorithm = DEFAULT_ALGORITHM, use_mmap = False):
+    """Hash many files on a thread pool, return {filename: (size, digest)}"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda f: hash_file(f, buffer_size, algorithm, use_mmap), filenames)
+        return dict(zip(filenames, results))
+
+
+def hash_data(data, algorithm = DEFAULT_ALGORITHM):
+    """Calculate the digest of data, return (size, digest)"""
     if isinstance(data, str):
         # Encode the string to bytes
         data = data.encode()
 
-    data_hash = hashlib.md5(data)
+    data_hash = new_hash(algorithm)
+    data_hash.update(data)
     return len(data), data_hash.hexdigest()
 
 
+def hash_chunks(chunks, algorithm = DEFAULT_ALGORITHM):
+    """Calculate the digest of an iterable of byte chunks, return (size, digest)"""
+    data_size = 0
+    data_hash = new_hash(algorithm)
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data_hash.update(chunk)
+        data_size += len(chunk)
+
+    return data_size, data_hash.hexdigest()
+
+
+class HashingReader:
+    """Read-only file wrapper that computes the digest of the file while it is parsed.
+
+    Bytes are hashed the first time the reader passes them, so the parser may
+    seek backwards freely. digest() hashes whatever has not been read yet.
+    """
+
+    def __init__(self, filename, buffer_size = 1048576, algorithm = DEFAULT_ALGORITHM):
+        self._file = open(filename, "rb", buffering=buffer_size)
+        self._hash = new_hash(algorithm)
+        self._hashed = 0
+        self._position = 0
+        self.name = self._file.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, size=-1):
+        if self._position > self._hashed:
+            self._catch_up(self._position)
+
+        data = self._file.read(size)
+        start = self._position
+        self._position += len(data)
+
+        if self._position > self._hashed:
+            self._hash.update(memoryview(data)[self._hashed - start:])
+            self._hashed = self._position
+        return data
+
+    def seek(self, offset, whence=0):
+        self._position = self._file.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def digest(self):
+        """Hash the unread remainder of the file, return (size, digest)"""
+        self._catch_up()
+        return self._hashed, self._hash.hexdigest()
+
+    def _catch_up(self, until=None):
+        self._file.seek(self._hashed)
+        while until is None or self._hashed < until:
+            chunk = self._file.read(65536 if until is None else min(65536, until - self._hashed))
+            if not chunk:
+                break
+            self._hash.update(chunk)
+            self._hashed += len(chunk)
+        self._file.seek(self._position)
+
+
 def hash_uid(uid, uid_root = "1.3.6.1.4.1.14519.5.2.1", trunc = 64, override=False):
     """Generate a hashed UID using MD5 digest."""
     if uid.startswith(uid_root) and not override:
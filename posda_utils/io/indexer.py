@@ -1,19 +1,34 @@
 # posda_utils/io/indexer.py
 
 import os
-import math
+import uuid
 import logging
-from glob import glob
+from collections import deque
 from tqdm import tqdm
 import concurrent.futures as futures
 import pandas as pd
+from sqlalchemy import select, delete, inspect
 from pydicom.errors import InvalidDicomError
 
 from posda_utils.io.reader import DicomFile
-from posda_utils.db.models import DicomIndex
+from posda_utils.io.hasher import DEFAULT_ALGORITHM
+from posda_utils.io.codec import JsonCodec
+from posda_utils.io.walker import walk_files
+from posda_utils.io.archive import (ARCHIVE_ERRORS, is_archive, is_zip, member_path,
+                                    iter_zip_members, read_zip_members, iter_tar_members)
+from posda_utils.db.models import DicomIndex, DicomIndexSeen, DicomElement, FileManifest
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BATCH_BYTES = 64 * 1024 * 1024
+DEFAULT_PREFETCH_BYTES = 256 * 1024 * 1024
+ELEMENT_BATCH_ROWS = 100000
+
+# Index rows are upserted on this key and only rewritten when one of the compare columns changed
+UPSERT_KEY = ("group_name", "sop_instance_uid", "file_path")
+UPSERT_COMPARE = ("meta_digest", "header_digest", "pixel_digest", "file_digest", "digest_algorithm",
+                  "pixel_data", "header_packed", "meta_packed")
+
 class DicomIndexer:
     def index_directory(self,
                         directory_path,
@@ -21,67 +36,546 @@ class DicomIndexer:
                         cpus=4,
                         group_name=None,
                         retain_pixel_data=False,
-                        db_manager=None):
-        files = self._get_all_files(directory_path)
-        batches = self._batch(files, cpus)
-        all_records = []
+                        db_manager=None,
+                        header_only=False,
+                        digest_file=False,
+                        digest_algorithm=DEFAULT_ALGORITHM,
+                        include=None,
+                        exclude=None,
+                        symlinks="follow",
+                        sniff_dicom=False,
+                        archives=False,
+                        prefetch=False,
+                        prefetch_depth=8,
+                        prefetch_bytes=DEFAULT_PREFETCH_BYTES,
+                        compression=None,
+                        elements=False,
+                        stream=False,
+                        batch_size=100,
+                        batch_bytes=DEFAULT_BATCH_BYTES,
+                        write_batch_size=1000,
+                        return_df=True):
+        """Index the DICOM files under directory_path, optionally upserting the rows into db_manager.
 
-        if multiproc:
-            with futures.ProcessPoolExecutor(max_workers=cpus) as executor:
-                futures_list = [
-                    executor.submit(self._index_batch, batch, retain_pixel_data, group_name)
-                    for batch in batches
-                ]
-                for future in tqdm(futures.as_completed(futures_list), total=len(futures_list), desc="Indexing DICOM file batches"):
-                    all_records.extend(future.result())
-        else:
-            for batch in tqdm(batches, desc="Indexing DICOM file batches"):
-                all_records.extend(self._index_batch(batch, retain_pixel_data, group_name))
+        Work units hold up to batch_size files or batch_bytes bytes. stream
+        writes every write_batch_size rows as files are found; return_df=False
+        skips the DataFrame. archives indexes zip/tar members as
+        'archive!member'. prefetch reads up to prefetch_depth units or
+        prefetch_bytes ahead. compression (True or a JsonCodec) stores the JSON
+        in header_packed/meta_packed. elements also writes dicom_element rows.
+        """
+        files = self._get_all_files(directory_path, include, exclude, symlinks, sniff_dicom, archives)
+        batch_args = (retain_pixel_data, group_name, header_only, digest_file, digest_algorithm,
+                      self._json_codec(compression), elements)
+
+        if stream:
+            run_id = None
+            if db_manager:
+                db_manager.create_table_from_model(DicomIndex)
+                db_manager.create_table_from_model(DicomIndexSeen)
+                with db_manager.engine.begin() as conn:
+                    self._delete_keyless(conn, DicomIndex, group_name)
+                run_id = uuid.uuid4().hex
+            if db_manager and elements:
+                db_manager.create_table_from_model(DicomElement)
+            result = self._index_stream(files, batch_args, multiproc=multiproc, cpus=cpus,
+                                        batch_size=batch_size, batch_bytes=batch_bytes, archives=archives,
+                                        prefetch=prefetch, prefetch_depth=prefetch_depth, prefetch_bytes=prefetch_bytes,
+                                        db_manager=db_manager, write_batch_size=write_batch_size,
+                                        return_df=return_df, run_id=run_id,
+                                        element_db=db_manager if elements else None)
+            if db_manager:
+                self._delete_unseen(db_manager, group_name, run_id)
+                self._clean_elements(db_manager, group_name, elements)
+            return result
 
-        df = pd.DataFrame(all_records)
+        if db_manager and elements:
+            db_manager.create_table_from_model(DicomElement)
+        df = self._index_stream(list(files), batch_args, multiproc=multiproc, cpus=cpus,
+                                batch_size=batch_size, batch_bytes=batch_bytes, archives=archives,
+                                prefetch=prefetch, prefetch_depth=prefetch_depth, prefetch_bytes=prefetch_bytes,
+                                element_db=db_manager if elements else None)
 
         if db_manager:
             db_manager.create_table_from_model(DicomIndex)
             self._write_to_db(df, DicomIndex, db_manager, group_name)
+            self._clean_elements(db_manager, group_name, elements)
+
+        return df if return_df else None
+
+    def reindex_directory(self,
+                          directory_path,
+                          group_name,
+                          db_manager,
+                          multiproc=True,
+                          cpus=4,
+                          track_inode=False,
+                          retain_pixel_data=False,
+                          header_only=False,
+                          digest_file=False,
+                          digest_algorithm=DEFAULT_ALGORITHM,
+                          include=None,
+                          exclude=None,
+                          symlinks="follow",
+                          sniff_dicom=False,
+                          archives=False,
+                          prefetch=False,
+                          prefetch_depth=8,
+                          prefetch_bytes=DEFAULT_PREFETCH_BYTES,
+                          compression=None,
+                          elements=False,
+                          batch_size=100,
+                          batch_bytes=DEFAULT_BATCH_BYTES,
+                          write_batch_size=1000):
+        """Re-index only the files under directory_path that are new or changed since the last run.
+
+        Files are compared to the group's file manifest by size and mtime, and
+        by inode with track_inode. Rows of changed and vanished files are
+        deleted, new and changed files are indexed. Returns the added, changed,
+        removed and unchanged file counts. With archives, an archive is
+        tracked as one file and all of its members are re-indexed when it changes.
+        """
+        db_manager.create_table_from_model(DicomIndex)
+        db_manager.create_table_from_model(FileManifest)
+        if elements:
+            db_manager.create_table_from_model(DicomElement)
+        # Element rows of an earlier run are cleared with their files even when elements is off
+        indexed_models = [DicomIndex, DicomElement] if self._has_elements(db_manager) else [DicomIndex]
+
+        manifest = self._load_manifest(db_manager, group_name)
+        current = {}
+        for path in self._get_all_files(directory_path, include, exclude, symlinks, sniff_dicom, archives):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Cannot stat {path}: {e}")
+                continue
+            current[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino if track_inode else None)
+
+        added, changed = [], []
+        for path, (size, mtime, inode) in current.items():
+            if path not in manifest:
+                added.append(path)
+                continue
+            old_size, old_mtime, old_inode = manifest[path]
+            if size != old_size or mtime != old_mtime or (inode and old_inode and inode != old_inode):
+                changed.append(path)
+        removed = [path for path in manifest if path not in current]
+
+        if manifest:
+            # Added files are cleared too, in case an interrupted run indexed them without a manifest entry
+            for orm_model in indexed_models:
+                self._delete_paths(orm_model, db_manager, group_name, added + changed + removed)
+                if archives:
+                    self._delete_members(orm_model, db_manager, group_name,
+                                         [path for path in added + changed + removed if is_archive(path)])
+            self._delete_paths(FileManifest, db_manager, group_name, changed + removed)
+        else:
+            for orm_model in indexed_models:
+                self._delete_group(orm_model, db_manager, group_name)
+
+        batch_args = (retain_pixel_data, group_name, header_only, digest_file, digest_algorithm,
+                      self._json_codec(compression), elements)
+        self._index_stream(added + changed, batch_args, multiproc=multiproc, cpus=cpus,
+                           batch_size=batch_size, batch_bytes=batch_bytes, archives=archives,
+                           prefetch=prefetch, prefetch_depth=prefetch_depth, prefetch_bytes=prefetch_bytes,
+                           db_manager=db_manager, write_batch_size=write_batch_size, return_df=False,
+                           element_db=db_manager if elements else None)
+        if DicomElement in indexed_models:
+            self._delete_orphan_elements(db_manager, group_name)
+
+        manifest_rows = []
+        for path in added + changed:
+            size, mtime, inode = current[path]
+            manifest_rows.append({"group_name": group_name, "file_path": path,
+                                  "file_size": size, "file_mtime": mtime, "file_inode": inode})
+        for i in range(0, len(manifest_rows), write_batch_size):
+            self._insert_records(manifest_rows[i:i + write_batch_size], FileManifest, db_manager)
+
+        counts = {
+            "added": len(added),
+            "changed": len(changed),
+            "removed": len(removed),
+            "unchanged": len(current) - len(added) - len(changed),
+        }
+        logger.info(f"Re-indexed '{group_name}': {counts}")
+        return counts
+
+    def _index_stream(self, files, batch_args, multiproc=True, cpus=4, batch_size=100,
+                      batch_bytes=DEFAULT_BATCH_BYTES, archives=False, prefetch=False, prefetch_depth=8,
+                      prefetch_bytes=DEFAULT_PREFETCH_BYTES, db_manager=None, write_batch_size=1000, return_df=True,
+                      run_id=None, element_db=None):
+        """Index files in work units, writing rows to db_manager every write_batch_size rows.
+
+        With a run_id, rows are upserted instead of inserted and their keys
+        are staged in dicom_index_seen under that run_id. Element rows
+        are written to element_db as they arrive, replacing those of the same files.
+        """
+        sized_files = ((path, self._file_size(path)) for path in files)
+        total_bytes = None
+        if isinstance(files, list):
+            sized_files = list(sized_files)
+            total_bytes = sum(size for _, size in sized_files)
+            if multiproc:
+                # Aim for at least four units per worker when the total is known
+                batch_bytes = max(1, min(batch_bytes, total_bytes // (4 * cpus)))
+            if archives and any(is_archive(path) for path, _ in sized_files):
+                # Members are counted uncompressed, so the on-disk total does not apply
+                total_bytes = None
+
+        all_records = []
+        pending_rows = []
+        pending_elements = []
+        written = 0
+        file_count = 0
 
-        return df
+        units = self._iter_units(sized_files, batch_size, batch_bytes, archives)
+        if prefetch:
+            units = self._prefetch_units(units, prefetch_depth, prefetch_bytes)
+        with tqdm(total=total_bytes, desc="Indexing DICOM files", unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            for batch_files, batch_total, (rows, element_rows) in self._iter_batch_results(units, batch_args,
+                                                                                          multiproc, cpus):
+                file_count += batch_files
+                progress.update(batch_total)
+                progress.set_postfix(files=file_count,
+                                     rate=f"{file_count / max(progress.format_dict['elapsed'], 1e-6):.1f} files/s")
+                if return_df:
+                    all_records.extend(rows)
+                if db_manager:
+                    pending_rows.extend(rows)
+                    if len(pending_rows) >= write_batch_size:
+                        self._write_rows(pending_rows, db_manager, run_id)
+                        written += len(pending_rows)
+                        pending_rows = []
+                if element_db:
+                    # Units never split a file, so each flush holds every element of its files
+                    pending_elements.extend(element_rows)
+                    if len(pending_elements) >= ELEMENT_BATCH_ROWS:
+                        self._write_elements(pending_elements, element_db)
+                        pending_elements = []
 
-    def _index_batch(self, file_paths, retain_pixels, group_name):
-        results = []
+        if element_db and pending_elements:
+            self._write_elements(pending_elements, element_db)
+
+        if db_manager and pending_rows:
+            self._write_rows(pending_rows, db_manager, run_id)
+            written += len(pending_rows)
+        if db_manager:
+            logger.info(f"Wrote {written} records to '{DicomIndex.__tablename__}'.")
+
+        return pd.DataFrame(all_records) if return_df else None
+
+    def _iter_batch_results(self, units, batch_args, multiproc, cpus):
+        """Yield (file count, bytes, rows) per unit as units complete, keeping at most 2 * cpus in flight."""
+        if not multiproc:
+            for index_func, payload, unit_files, unit_total in units:
+                yield unit_files, unit_total, index_func(payload, *batch_args)
+            return
+
+        with futures.ProcessPoolExecutor(max_workers=cpus) as executor:
+            in_flight = {}
+            for index_func, payload, unit_files, unit_total in units:
+                in_flight[executor.submit(index_func, payload, *batch_args)] = (unit_files, unit_total)
+                if len(in_flight) >= 2 * cpus:
+                    done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield *in_flight.pop(future), future.result()
+            for future in futures.as_completed(list(in_flight)):
+                yield *in_flight.pop(future), future.result()
+
+    def _index_batch(self, file_paths, retain_pixels, group_name, header_only=False, digest_file=False,
+                     digest_algorithm=DEFAULT_ALGORITHM, codec=None, elements=False):
+        results, element_rows = [], []
         for path in file_paths:
             try:
-                dcm_file = DicomFile()
-                dcm_file.from_dicom_path(path, retain_pixel_data=retain_pixels)
+                dcm_file = DicomFile(digest_algorithm=digest_algorithm)
+                dcm_file.from_dicom_path(path, retain_pixel_data=retain_pixels, header_only=header_only, digest_file=digest_file)
                 if dcm_file.exists:
-                    results.append(dcm_file.to_index_row(group_name=group_name))
+                    results.append(dcm_file.to_index_row(group_name=group_name, codec=codec))
+                    if elements:
+                        element_rows.extend(dcm_file.to_element_rows(group_name=group_name))
             except InvalidDicomError:
                 continue
             except Exception as e:
                 logger.error(f"Error reading {path}: {e}")
-        return results
+        return results, element_rows
+
+    def _index_zip_batch(self, unit, retain_pixels, group_name, header_only=False, digest_file=False,
+                         digest_algorithm=DEFAULT_ALGORITHM, codec=None, elements=False):
+        archive_path, member_names = unit
+        members = ((member_path(archive_path, name), data)
+                   for name, data in read_zip_members(archive_path, member_names))
+        return self._index_bytes_batch(members, retain_pixels, group_name, header_only, digest_file, digest_algorithm,
+                                       codec, elements)
+
+    def _index_bytes_batch(self, members, retain_pixels, group_name, header_only=False, digest_file=False,
+                           digest_algorithm=DEFAULT_ALGORITHM, codec=None, elements=False):
+        results, element_rows = [], []
+        for path, data in members:
+            try:
+                dcm_file = DicomFile(digest_algorithm=digest_algorithm)
+                dcm_file.from_dicom_bytes(data, retain_pixel_data=retain_pixels, header_only=header_only,
+                                          digest_file=digest_file, file_path=path)
+                if dcm_file.exists:
+                    results.append(dcm_file.to_index_row(group_name=group_name, codec=codec))
+                    if elements:
+                        element_rows.extend(dcm_file.to_element_rows(group_name=group_name))
+            except InvalidDicomError:
+                continue
+            except Exception as e:
+                logger.error(f"Error reading {path}: {e}")
+        return results, element_rows
+
+    def _json_codec(self, compression):
+        if compression is None or compression is False:
+            return None
+        return JsonCodec() if compression is True else compression
 
     def _write_to_db(self, df, orm_model, db_manager, group_name=None):
-        records = df.to_dict(orient="records")
+        """Upsert the rows and delete the group's rows for files that are gone, in one transaction."""
+        keys = set()
+        if not df.empty:
+            uids = df["sop_instance_uid"].astype(object).where(df["sop_instance_uid"].notna(), None)
+            keys = set(zip(uids, df["file_path"]))
+        try:
+            with db_manager.engine.begin() as conn:
+                self._delete_keyless(conn, orm_model, group_name)
+                db_manager.bulk_upsert(orm_model, df, UPSERT_KEY, UPSERT_COMPARE, conn=conn)
+                self._delete_stale(conn, orm_model, group_name, keys)
+        except Exception as e:
+            logger.error(f"Failed to write records: {e}")
+            raise
+        logger.info(f"Wrote {len(df)} records to '{orm_model.__tablename__}'.")
+
+    def _write_rows(self, rows, db_manager, run_id=None):
+        if run_id is None:
+            self._insert_records(rows, DicomIndex, db_manager)
+            return
+        seen = [{"run_id": run_id, "sop_instance_uid": row["sop_instance_uid"], "file_path": row["file_path"]}
+                for row in rows]
+        with db_manager.engine.begin() as conn:
+            db_manager.bulk_upsert(DicomIndex, rows, UPSERT_KEY, UPSERT_COMPARE, conn=conn)
+            db_manager.bulk_load(DicomIndexSeen, seen, conn=conn)
+
+    def _write_elements(self, rows, db_manager, chunk_size=500):
+        group_name = rows[0]["group_name"]
+        paths = sorted({row["file_path"] for row in rows})
+        try:
+            with db_manager.engine.begin() as conn:
+                for i in range(0, len(paths), chunk_size):
+                    conn.execute(delete(DicomElement).where(DicomElement.group_name == group_name,
+                                                            DicomElement.file_path.in_(paths[i:i + chunk_size])))
+                db_manager.bulk_load(DicomElement, rows, conn=conn)
+        except Exception as e:
+            logger.error(f"Failed to write element records: {e}")
+            raise
+
+    def _has_elements(self, db_manager):
+        return inspect(db_manager.engine).has_table(DicomElement.__tablename__)
+
+    def _clean_elements(self, db_manager, group_name, elements):
+        """After indexing a whole group, delete its element rows that no longer match dicom_index.
+
+        Without elements every file was re-indexed without element rows, so all of the group's rows go.
+        """
+        if not self._has_elements(db_manager):
+            return
+        if elements:
+            self._delete_orphan_elements(db_manager, group_name)
+        else:
+            self._delete_group(DicomElement, db_manager, group_name)
+
+    def _delete_orphan_elements(self, db_manager, group_name):
+        """Delete the group's element rows whose file is no longer in dicom_index."""
+        indexed = select(DicomIndex.file_path).where(DicomIndex.group_name == group_name)
+        with db_manager.engine.begin() as conn:
+            deleted = conn.execute(delete(DicomElement).where(DicomElement.group_name == group_name,
+                                                              DicomElement.file_path.not_in(indexed))).rowcount
+        if deleted:
+            logger.info(f"Deleted {deleted} orphaned records from '{DicomElement.__tablename__}'.")
+
+    def _delete_keyless(self, conn, orm_model, group_name):
+        # Rows without a SOP Instance UID never match the unique key, so they are replaced rather than upserted
+        if group_name:
+            conn.execute(delete(orm_model).where(orm_model.group_name == group_name,
+                                                 orm_model.sop_instance_uid.is_(None)))
+
+    def _delete_stale(self, conn, orm_model, group_name, keys, chunk_size=500):
+        if not group_name:
+            return
+        existing = conn.execute(select(orm_model.index_id, orm_model.sop_instance_uid, orm_model.file_path)
+                                .where(orm_model.group_name == group_name))
+        stale = [index_id for index_id, uid, path in existing if (uid, path) not in keys]
+        for i in range(0, len(stale), chunk_size):
+            conn.execute(delete(orm_model).where(orm_model.index_id.in_(stale[i:i + chunk_size])))
+        if stale:
+            logger.info(f"Deleted {len(stale)} stale records from '{orm_model.__tablename__}'.")
+
+    def _delete_unseen(self, db_manager, group_name, run_id):
+        """Delete the group's rows whose key the run did not stage, then the run's staged keys, in the database."""
+        seen = select(DicomIndexSeen.seen_id).where(
+            DicomIndexSeen.run_id == run_id,
+            DicomIndexSeen.file_path == DicomIndex.file_path,
+            DicomIndexSeen.sop_instance_uid.is_not_distinct_from(DicomIndex.sop_instance_uid),
+        ).exists()
+        try:
+            with db_manager.engine.begin() as conn:
+                stale = 0
+                if group_name:
+                    stale = conn.execute(delete(DicomIndex).where(DicomIndex.group_name == group_name, ~seen)).rowcount
+                conn.execute(delete(DicomIndexSeen).where(DicomIndexSeen.run_id == run_id))
+        except Exception as e:
+            logger.error(f"Failed to delete stale records: {e}")
+            raise
+        if stale:
+            logger.info(f"Deleted {stale} stale records from '{DicomIndex.__tablename__}'.")
+
+    def _delete_group(self, orm_model, db_manager, group_name):
+        if not group_name:
+            return
+        try:
+            deleted = db_manager.session.query(orm_model)\
+                .filter(orm_model.group_name == group_name)\
+                .delete(synchronize_session=False)
+            db_manager.session.commit()
+            logger.info(f"Deleted {deleted} existing records.")
+        except Exception as e:
+            db_manager.session.rollback()
+            logger.error(f"Failed to delete existing records: {e}")
+            raise
+
+    def _delete_paths(self, orm_model, db_manager, group_name, paths, chunk_size=500):
         try:
             deleted = 0
-            if group_name:
-                deleted = db_manager.session.query(orm_model)\
-                    .filter(orm_model.group_name == group_name)\
+            for i in range(0, len(paths), chunk_size):
+                deleted += db_manager.session.query(orm_model)\
+                    .filter(orm_model.group_name == group_name, orm_model.file_path.in_(paths[i:i + chunk_size]))\
                     .delete(synchronize_session=False)
-                db_manager.session.commit()
-                logger.info(f"Deleted {deleted} existing records.")
+            db_manager.session.commit()
+            logger.info(f"Deleted {deleted} records from '{orm_model.__tablename__}'.")
+        except Exception as e:
+            db_manager.session.rollback()
+            logger.error(f"Failed to delete records by path: {e}")
+            raise
 
-            db_manager.session.bulk_insert_mappings(orm_model, records)
+    def _delete_members(self, orm_model, db_manager, group_name, archive_paths):
+        try:
+            deleted = 0
+            for archive_path in archive_paths:
+                deleted += db_manager.session.query(orm_model)\
+                    .filter(orm_model.group_name == group_name,
+                            orm_model.file_path.startswith(member_path(archive_path, ""), autoescape=True))\
+                    .delete(synchronize_session=False)
             db_manager.session.commit()
-            logger.info(f"Wrote {len(df)} records to '{orm_model.__tablename__}'.")
+            logger.info(f"Deleted {deleted} archive member records from '{orm_model.__tablename__}'.")
         except Exception as e:
             db_manager.session.rollback()
-            logger.error(f"Failed to write to ORM table: {e}")
+            logger.error(f"Failed to delete archive member records: {e}")
             raise
 
-    def _get_all_files(self, directory_path):
-        return [f for f in glob(os.path.join(directory_path, "**", "*"), recursive=True) if os.path.isfile(f)]
+    def _load_manifest(self, db_manager, group_name):
+        rows = db_manager.session.query(
+            FileManifest.file_path, FileManifest.file_size, FileManifest.file_mtime, FileManifest.file_inode
+        ).filter(FileManifest.group_name == group_name)
+        return {path: (size, mtime, inode) for path, size, mtime, inode in rows}
+
+    def _insert_records(self, records, orm_model, db_manager):
+        db_manager.bulk_load(orm_model, records)
+
+    def _get_all_files(self, directory_path, include=None, exclude=None, symlinks="follow", sniff_dicom=False,
+                       archives=False):
+        if os.path.isfile(directory_path):
+            return iter([directory_path])
+        # Archives have no DICM preamble, they are kept for the member walk instead of being sniffed
+        return walk_files(directory_path, include=include, exclude=exclude, symlinks=symlinks, dicom_only=sniff_dicom,
+                          keep=is_archive if archives else None)
+
+    def _iter_units(self, sized_files, batch_size, batch_bytes, archives=False):
+        """Yield work units of (index function, payload, file count, bytes).
+
+        Plain files are batched by path. With archives, archive paths are set
+        aside and expanded into member units once the plain files are queued.
+        """
+        archive_paths = []
+
+        def plain_files():
+            for path, size in sized_files:
+                if archives and is_archive(path):
+                    archive_paths.append(path)
+                else:
+                    yield path, size
+
+        for batch, batch_total in self._iter_batches(plain_files(), batch_size, batch_bytes):
+            yield self._index_batch, batch, len(batch), batch_total
+        for archive_path in archive_paths:
+            yield from self._iter_archive_units(archive_path, batch_size, batch_bytes)
 
-    def _batch(self, files, cpus):
-        batch_size = max(1, min(100, math.ceil(len(files) / cpus)))
-        return [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    def _iter_archive_units(self, archive_path, batch_size, batch_bytes):
+        """Zip members are batched by name and read by the worker. Tar members are
+        read here in one forward pass and shipped to the worker as bytes, so a
+        compressed tar is only decompressed once."""
+        try:
+            if is_zip(archive_path):
+                members = list(iter_zip_members(archive_path))
+                for names, batch_total in self._iter_batches(members, batch_size, batch_bytes):
+                    yield self._index_zip_batch, (archive_path, names), len(names), batch_total
+            else:
+                members = (((member_path(archive_path, name), data), len(data))
+                           for name, data in iter_tar_members(archive_path))
+                for batch, batch_total in self._iter_batches(members, batch_size, batch_bytes):
+                    yield self._index_bytes_batch, batch, len(batch), batch_total
+        except ARCHIVE_ERRORS as e:
+            logger.error(f"Cannot read archive {archive_path}: {e}")
+
+    def _prefetch_units(self, units, prefetch_depth, prefetch_bytes):
+        """Read plain file units ahead on a thread pool, turning them into in-memory units.
+
+        At most prefetch_depth units and prefetch_bytes bytes are read ahead;
+        a unit larger than the budget is still read, on its own. Archive units
+        pass through unchanged.
+        """
+        with futures.ThreadPoolExecutor(max_workers=prefetch_depth) as executor:
+            pending = deque()
+            pending_bytes = 0
+            for unit in units:
+                index_func, payload, unit_files, unit_total = unit
+                if index_func != self._index_batch:
+                    yield unit
+                    continue
+                while pending and (len(pending) >= prefetch_depth or pending_bytes + unit_total > prefetch_bytes):
+                    future, ready_files, ready_total = pending.popleft()
+                    pending_bytes -= ready_total
+                    yield self._index_bytes_batch, future.result(), ready_files, ready_total
+                pending.append((executor.submit(self._read_batch, payload), unit_files, unit_total))
+                pending_bytes += unit_total
+            while pending:
+                future, ready_files, ready_total = pending.popleft()
+                yield self._index_bytes_batch, future.result(), ready_files, ready_total
+
+    def _read_batch(self, file_paths):
+        members = []
+        for path in file_paths:
+            try:
+                with open(path, "rb") as f:
+                    members.append((path, f.read()))
+            except OSError as e:
+                logger.error(f"Error reading {path}: {e}")
+        return members
+
+    def _iter_batches(self, sized_files, batch_size, batch_bytes):
+        """Group (path, size) pairs into units of at most batch_size files or batch_bytes bytes."""
+        batch, batch_total = [], 0
+        for path, size in sized_files:
+            if batch and (len(batch) >= batch_size or batch_total + size > batch_bytes):
+                yield batch, batch_total
+                batch, batch_total = [], 0
+            batch.append(path)
+            batch_total += size
+        if batch:
+            yield batch, batch_total
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
@@ -1,139 +1,339 @@
 # posda_utils/io/reader.py
 
 import pydicom as dcm
-import chardet
 import logging
 import base64
+import json
+import struct
 from io import BytesIO
+from sys import intern
+from collections import namedtuple
 from pydicom.errors import InvalidDicomError
+from pydicom.filereader import read_dataset
+from pydicom.uid import DeflatedExplicitVRLittleEndian
+from pydicom.valuerep import EXPLICIT_VR_LENGTH_32
 
-from posda_utils.io.hasher import hash_data
+from posda_utils.io.hasher import DEFAULT_ALGORITHM, hash_data, hash_chunks, HashingReader
+from posda_utils.io.decoder import DEFAULT_ENCODINGS, dataset_encodings, decode_value
+from posda_utils.io.codec import decompress_json
+
+PIXEL_DATA_TAG = 0x7FE00010
+SEQUENCE_DELIMITER_TAG = 0xFFFEE0DD
+UNDEFINED_LENGTH = 0xFFFFFFFF
+PIXEL_CHUNK_SIZE = 1024 * 1024
+
+
+class ElementRecord(namedtuple("ElementRecord", [
+        "label", "vr", "vm", "value",
+        "group", "element", "name", "keyword", "is_private", "private_creator"])):
+    """Immutable summary of an indexed data element, without a reference to the dataset."""
+    __slots__ = ()
+
+
+def iter_dataset_json(dataset, exclude=(PIXEL_DATA_TAG,)):
+    """Yield the DICOM JSON of a dataset element by element.
+
+    Joined, the pieces are identical to Dataset.to_json(), so digests can be
+    computed while serializing and excluded tags never have to be copied out.
+    """
+    yield "{"
+    separator = ""
+    for tag in sorted(dataset.keys()):
+        if tag in exclude:
+            continue
+        element_json = dataset[tag].to_json_dict(bulk_data_element_handler=None, bulk_data_threshold=1024)
+        yield f'{separator}"{tag:08X}": '
+        yield json.dumps(element_json, sort_keys=True)
+        separator = ", "
+    yield "}"
 
 
 class DicomFile:
-    def __init__(self):
+    def __init__(self, digest_algorithm=DEFAULT_ALGORITHM):
         self.exists = False
+        self.digest_algorithm = digest_algorithm
         self.info = None
         
+        self.file_digest = None
+        self.file_size = None
+
         self.pixel_data = None
         self.pixel_digest = None
         self.pixel_size = 0
+        self.pixel_offset = None
+        self.pixel_length = None
 
         self.meta_json = None
         self.meta_data = None
         self.meta_digest = None
         self.meta_size = 0
-        self.meta_dict = {}
+        self._meta_dict = None
         
         self.header_json = None
         self.header_data = None
         self.header_digest = None
         self.header_size = 0
-        self.header_dict = {}
-
-    def from_json(self, meta_json, header_json, pixel_data, info=None):
-        """Load DICOM file from JSON representations of meta and header."""
+        self._header_dict = None
+
+        self._parse_cache = None
+
+    @property
+    def meta_data(self):
+        """File meta dataset; when loaded from JSON it is parsed from meta_json on first access."""
+        if self._meta_data is None and self._meta_deferred:
+            self._meta_data = dcm.Dataset.from_json(self.meta_json)
+            self._meta_deferred = False
+        return self._meta_data
+
+    @meta_data.setter
+    def meta_data(self, dataset):
+        self._meta_data = dataset
+        self._meta_deferred = False
+
+    @property
+    def header_data(self):
+        """Header dataset; when loaded from JSON it is parsed from header_json on first access."""
+        if self._header_data is None and self._header_deferred:
+            self._header_data = dcm.Dataset.from_json(self.header_json)
+            self._header_deferred = False
+        return self._header_data
+
+    @header_data.setter
+    def header_data(self, dataset):
+        self._header_data = dataset
+        self._header_deferred = False
+
+    @property
+    def meta_dict(self):
+        """Tag index of the file meta, built on first access."""
+        if self._meta_dict is None:
+            self._meta_dict = self._index_elements(self.meta_data) if self.meta_data is not None else {}
+            if self._parse_cache is not None:
+                self._parse_cache.put(self.digest_algorithm, self.meta_digest, self._meta_dict)
+        return self._meta_dict
+
+    @property
+    def header_dict(self):
+        """Tag index of the header, built on first access."""
+        if self._header_dict is None:
+            self._header_dict = self._index_elements(self.header_data) if self.header_data is not None else {}
+            if self._parse_cache is not None:
+                self._parse_cache.put(self.digest_algorithm, self.header_digest, self._header_dict)
+        return self._header_dict
+
+    def from_json(self, meta_json, header_json, pixel_data, info=None, pixel_digest=None, pixel_size=None,
+                  parse_cache=None):
+        """Load DICOM file from JSON representations of meta and header.
+
+        A stored pixel_digest/pixel_size is carried through as is, otherwise
+        the digest is computed from pixel_data. meta_json and header_json may
+        also be the zstd-compressed bytes of the packed index columns.
+
+        Only the digests are computed here; the datasets are parsed when
+        meta_data/header_data or the tag dictionaries are first read, so
+        files compared by digest alone are never parsed. With a ParseCache,
+        the tag dictionaries are looked up by the JSON digests, and ones built
+        on a miss are cached.
+        """
         self.exists = True
         self.info = info
 
-        self.meta_data = dcm.Dataset.from_json(meta_json)
+        meta_json = decompress_json(meta_json)
+        header_json = decompress_json(header_json)
+
+        self._parse_cache = parse_cache
+
         self.meta_json = meta_json
-        self.meta_size, self.meta_digest = hash_data(meta_json)
-        self.meta_dict = self._index_elements(self.meta_data)
+        self.meta_size, self.meta_digest = hash_data(meta_json, self.digest_algorithm)
+        self.meta_data = None
+        self._meta_deferred = True
+        self._meta_dict = parse_cache.get(self.digest_algorithm, self.meta_digest) if parse_cache is not None else None
 
-        self.header_data = dcm.Dataset.from_json(header_json)
         self.header_json = header_json
-        self.header_size, self.header_digest = hash_data(header_json)
-        self.header_dict = self._index_elements(self.header_data)
+        self.header_size, self.header_digest = hash_data(header_json, self.digest_algorithm)
+        self.header_data = None
+        self._header_deferred = True
+        self._header_dict = parse_cache.get(self.digest_algorithm, self.header_digest) if parse_cache is not None else None
 
-        if pixel_data:
+        if pixel_digest:
             self.pixel_data = pixel_data
+            self.pixel_size, self.pixel_digest = pixel_size, pixel_digest
+        elif pixel_data:
             try:
-                pixel_bytes = base64.b64decode(pixel_data)
-                self.pixel_size, self.pixel_digest = hash_data(pixel_bytes)
+                # Rows indexed before pixels were stored as binary hold base64 text
+                self.pixel_data = base64.b64decode(pixel_data) if isinstance(pixel_data, str) else pixel_data
+                self.pixel_size, self.pixel_digest = hash_data(self.pixel_data, self.digest_algorithm)
             except Exception as e:
                 logging.warning(f"Could not decode pixel data from JSON: {e}")
                 self.pixel_size, self.pixel_digest = None, None
 
-    def from_dicom_path(self, dicom_path, retain_pixel_data=False):
-        """Load and parse a DICOM file from disk."""
+    def from_dicom_path(self, dicom_path, retain_pixel_data=False, header_only=False, digest_file=False):
+        """Load and parse a DICOM file from disk.
+
+        With header_only the parser stops at PixelData and the pixel digest is
+        streamed from the file in fixed-size chunks, so the pixels are never
+        held in memory. With digest_file the file is read through a hashing
+        tee, producing file_digest/file_size from the same single pass.
+        """
         try:
-            dataset = dcm.dcmread(dicom_path, force=False)
+            with (HashingReader(dicom_path, algorithm=self.digest_algorithm) if digest_file else open(dicom_path, "rb")) as fp:
+                dataset = self._read_dataset(fp, retain_pixel_data, header_only, dicom_path)
+                if digest_file:
+                    self.file_size, self.file_digest = fp.digest()
 
             self.exists = True
             self.info = {"FilePath": dicom_path}
-
-            if "PixelData" in dataset:
-                pixel_data = dataset.PixelData
-                if isinstance(pixel_data, (bytes, bytearray, memoryview)):
-                    self.pixel_size, self.pixel_digest = hash_data(pixel_data)
-                    if retain_pixel_data:
-                        self.pixel_data = base64.b64encode(pixel_data).decode("utf-8")
-                else:
-                    logging.warning(f"Unsupported PixelData type in {dicom_path}: {type(pixel_data)}")
-                    self.pixel_size = self.pixel_digest = self.pixel_data = None
-                
-            self.meta_data = dataset.file_meta
-            self.meta_json = self.meta_data.to_json()
-            self.meta_size, self.meta_digest = hash_data(self.meta_json)
-            self.meta_dict = self._index_elements(self.meta_data)
-            
-            self.header_data = dataset.copy()
-            if "PixelData" in self.header_data:
-                del self.header_data.PixelData
-            if hasattr(self.header_data, "file_meta"):
-                del self.header_data.file_meta
-            self.header_json = self.header_data.to_json()
-            self.header_size, self.header_digest = hash_data(self.header_json)
-            self.header_dict = self._index_elements(self.header_data)
+            self._load_dataset(dataset)
 
         except InvalidDicomError:
             logging.warning(f"Invalid DICOM file: {dicom_path}")
         except Exception as e:
             logging.error(f"Failed to read DICOM file {dicom_path}: {e}")
 
-    def from_dicom_bytes(self, byte_data, retain_pixel_data=False):
-        """Load and parse a DICOM file from raw bytes."""
+    def from_dicom_bytes(self, byte_data, retain_pixel_data=False, header_only=False, digest_file=False, file_path=None):
+        """Load and parse a DICOM file from raw bytes.
+
+        file_path records where the bytes came from, e.g. an archive member.
+        """
+        source = file_path or "memory"
         try:
-            dataset = dcm.dcmread(BytesIO(byte_data), force=False)
+            dataset = self._read_dataset(BytesIO(byte_data), retain_pixel_data, header_only, source)
+            if digest_file:
+                self.file_size, self.file_digest = hash_data(byte_data, self.digest_algorithm)
 
             self.exists = True
-            self.info = {"Source": "memory"}
-
-            if "PixelData" in dataset:
-                pixel_data = dataset.PixelData
-                if isinstance(pixel_data, (bytes, bytearray, memoryview)):
-                    self.pixel_size, self.pixel_digest = hash_data(pixel_data)
-                    if retain_pixel_data:
-                        self.pixel_data = base64.b64encode(pixel_data).decode("utf-8")
-                else:
-                    logging.warning("Unsupported PixelData type in memory")
-                    self.pixel_size = self.pixel_digest = self.pixel_data = None
-
-            self.meta_data = dataset.file_meta
-            self.meta_json = self.meta_data.to_json()
-            self.meta_size, self.meta_digest = hash_data(self.meta_json)
-            self.meta_dict = self._index_elements(self.meta_data)
-
-            self.header_data = dataset.copy()
-            if "PixelData" in self.header_data:
-                del self.header_data.PixelData
-            if hasattr(self.header_data, "file_meta"):
-                del self.header_data.file_meta
-            self.header_json = self.header_data.to_json()
-            self.header_size, self.header_digest = hash_data(self.header_json)
-            self.header_dict = self._index_elements(self.header_data)
+            self.info = {"FilePath": file_path} if file_path else {"Source": "memory"}
+            self._load_dataset(dataset)
 
         except InvalidDicomError:
-            logging.warning("Invalid DICOM byte stream")
+            logging.warning(f"Invalid DICOM byte stream: {source}")
         except Exception as e:
-            logging.error(f"Failed to read DICOM bytes: {e}")
-
-    def to_index_row(self, group_name=None):
-        return {
+            logging.error(f"Failed to read DICOM bytes {source}: {e}")
+
+    def _read_dataset(self, fp, retain_pixel_data, header_only, source):
+        if header_only:
+            return self._read_header_only(fp, retain_pixel_data, source)
+
+        dataset = dcm.dcmread(fp, force=False)
+        self._load_pixel_data(dataset, retain_pixel_data, source)
+        return dataset
+
+    def _load_pixel_data(self, dataset, retain_pixel_data, source):
+        if "PixelData" in dataset:
+            pixel_data = dataset.PixelData
+            if isinstance(pixel_data, (bytes, bytearray, memoryview)):
+                self.pixel_size, self.pixel_digest = hash_data(pixel_data, self.digest_algorithm)
+                if retain_pixel_data:
+                    self.pixel_data = pixel_data
+            else:
+                logging.warning(f"Unsupported PixelData type in {source}: {type(pixel_data)}")
+                self.pixel_size = self.pixel_digest = self.pixel_data = None
+
+    def _load_dataset(self, dataset):
+        self._parse_cache = None
+        self.meta_data = dataset.file_meta
+        meta_parts = list(iter_dataset_json(self.meta_data))
+        self.meta_json = "".join(meta_parts)
+        self.meta_size, self.meta_digest = hash_chunks(meta_parts, self.digest_algorithm)
+        self._meta_dict = None
+
+        # The header is the parsed dataset itself, stripped in place instead of copied
+        if "PixelData" in dataset:
+            del dataset.PixelData
+        if hasattr(dataset, "file_meta"):
+            del dataset.file_meta
+        self.header_data = dataset
+        header_parts = list(iter_dataset_json(self.header_data))
+        self.header_json = "".join(header_parts)
+        self.header_size, self.header_digest = hash_chunks(header_parts, self.digest_algorithm)
+        self._header_dict = None
+
+    def _read_header_only(self, fp, retain_pixel_data, source):
+        """Parse a seekable DICOM stream up to PixelData and stream the pixel bytes into the digest."""
+        dataset = dcm.dcmread(fp, force=False, stop_before_pixels=True)
+
+        if dataset.file_meta.get("TransferSyntaxUID") == DeflatedExplicitVRLittleEndian:
+            # Deflated data sets are inflated in memory, there are no file offsets to stream from
+            fp.seek(0)
+            dataset = dcm.dcmread(fp, force=False)
+            self._load_pixel_data(dataset, retain_pixel_data, source)
+            return dataset
+
+        is_implicit_vr, is_little_endian = dataset.original_encoding
+        pixel_element = self._find_pixel_element(fp, is_implicit_vr, is_little_endian)
+        if pixel_element:
+            self.pixel_offset, self.pixel_length = pixel_element
+            chunks = self._iter_pixel_chunks(fp, self.pixel_length, is_little_endian)
+            if retain_pixel_data:
+                pixel_bytes = b"".join(chunks)
+                self.pixel_size, self.pixel_digest = hash_data(pixel_bytes, self.digest_algorithm)
+                self.pixel_data = pixel_bytes
+            else:
+                self.pixel_size, self.pixel_digest = hash_chunks(chunks, self.digest_algorithm)
+
+        # Elements stored after the pixel data (e.g. trailing padding) still belong to the header
+        dataset.update(read_dataset(fp, is_implicit_vr, is_little_endian))
+        return dataset
+
+    def _find_pixel_element(self, fp, is_implicit_vr, is_little_endian):
+        """Read the PixelData element header at the current position, return (value offset, length).
+
+        Length is None for encapsulated (undefined length) pixel data. Returns None,
+        and leaves the position unchanged, when the next element is not PixelData.
+        """
+        start = fp.tell()
+        endian = "<" if is_little_endian else ">"
+
+        header = fp.read(8)
+        if len(header) < 8:
+            fp.seek(start)
+            return None
+
+        group, element = struct.unpack(f"{endian}HH", header[:4])
+        if (group << 16 | element) != PIXEL_DATA_TAG:
+            fp.seek(start)
+            return None
+
+        # Some files declare explicit VR but are encoded implicit, as pydicom tolerates
+        if is_implicit_vr or not header[4:6].isalpha():
+            length = struct.unpack(f"{endian}L", header[4:])[0]
+        elif header[4:6].decode("ascii", "replace") in EXPLICIT_VR_LENGTH_32:
+            length = struct.unpack(f"{endian}L", fp.read(4))[0]
+        else:
+            length = struct.unpack(f"{endian}H", header[6:])[0]
+
+        return fp.tell(), None if length == UNDEFINED_LENGTH else length
+
+    def _iter_pixel_chunks(self, fp, length, is_little_endian):
+        """Yield the raw PixelData value in chunks, walking the items of encapsulated data."""
+        if length is not None:
+            yield from self._iter_stream(fp, length)
+            return
+
+        endian = "<" if is_little_endian else ">"
+        while len(item_header := fp.read(8)) == 8:
+            group, element, item_length = struct.unpack(f"{endian}HHL", item_header)
+            if (group << 16 | element) == SEQUENCE_DELIMITER_TAG:
+                return
+            yield item_header
+            yield from self._iter_stream(fp, item_length)
+
+    def _iter_stream(self, fp, length):
+        remaining = length
+        while remaining > 0 and (chunk := fp.read(min(PIXEL_CHUNK_SIZE, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+    def to_index_row(self, group_name=None, codec=None):
+        """Return the dicom_index row. With a JsonCodec, the header and meta JSON
+        go compressed into header_packed/meta_packed instead of the text columns."""
+        row = {
             "group_name": group_name,
 
             "file_path": self.info.get("FilePath") if self.info else None,
+            "file_digest": self.file_digest,
+            "file_size": self.file_size,
+            "digest_algorithm": self.digest_algorithm,
         
             "sop_class_uid": getattr(self.header_data, "SOPClassUID", None),
             "modality": getattr(self.header_data, "Modality", None),
@@ -150,15 +350,48 @@ class DicomFile:
             "meta_digest": self.meta_digest,
             "meta_size": self.meta_size,
 
-            "pixel_data": self.pixel_data if isinstance(self.pixel_data, str) else None,
+            "pixel_data": self.pixel_data if isinstance(self.pixel_data, (bytes, bytearray, memoryview)) else None,
             "pixel_digest": self.pixel_digest,
             "pixel_size": self.pixel_size,
         }
+        # All four JSON columns are always set, so an upsert that switches compression clears the other pair
+        row["header_packed"] = row["meta_packed"] = None
+        if codec is not None:
+            row["header_packed"] = codec.compress(row["header_data"])
+            row["meta_packed"] = codec.compress(row["meta_data"])
+            row["header_data"] = row["meta_data"] = None
+        return row
+
+    def to_element_rows(self, group_name=None):
+        """Return one dicom_element row per meta and header element, sequences flattened by tag path."""
+        file_path = self.info.get("FilePath") if self.info else None
+        sop_instance_uid = getattr(self.header_data, "SOPInstanceUID", None)
+        return [
+            {
+                "group_name": group_name,
+                "file_path": file_path,
+                "sop_instance_uid": sop_instance_uid,
+                "tag": record.label,
+                "tag_path": tag_path,
+                "tag_group": record.group,
+                "tag_element": record.element,
+                "tag_name": record.name,
+                "tag_keyword": record.keyword,
+                "tag_vr": record.vr,
+                "tag_vm": record.vm,
+                "is_private": record.is_private,
+                "private_creator": record.private_creator,
+                "value": "<REMOVED>" if record.vr == "SQ" else record.value,
+            }
+            for tag_path, record in (self.meta_dict | self.header_dict).items()
+        ]
 
-    def _index_elements(self, dataset, elements=None, depth=0, count=0, label=None):
+    def _index_elements(self, dataset, elements=None, depth=0, count=0, label=None, encodings=DEFAULT_ENCODINGS):
         if elements is None:
             elements = {}
 
+        encodings = dataset_encodings(dataset, encodings)
+
         ignore_values = {'Pixel Data', 'Overlay Data', 'File Meta Information Version'}
 
         for element in dataset:
@@ -172,34 +405,31 @@ class DicomFile:
 
             append = f'[<{str(count).zfill(4)}>]' if count else '[<0000>]'
             
-            tag_path = f'<{tag_str}>' if depth == 0 else f'{label}{append}<{tag_str}>'
-
-            element_info = {
-                'label': f'<{tag_str}>',
-                'vr': element.VR,
-                'vm': element.VM,
-                'value': self._safe_value(element.name, element.value, ignore_values),
-                'element': element
-            }
-
-            elements[tag_path] = element_info
+            tag_path = intern(f'<{tag_str}>' if depth == 0 else f'{label}{append}<{tag_str}>')
+
+            elements[tag_path] = ElementRecord(
+                label=intern(f'<{tag_str}>'),
+                vr=intern(str(element.VR)),
+                vm=element.VM,
+                value=self._safe_value(element.name, element.value, ignore_values, element.VR, encodings),
+                group=element.tag.group,
+                element=element.tag.element,
+                name=intern(element.name),
+                keyword=intern(element.keyword),
+                is_private=element.is_private,
+                private_creator=element.private_creator,
+            )
 
             if element.VR == 'SQ':
                 for i, item in enumerate(element.value or []):
-                    self._index_elements(item, elements, depth + 1, i, tag_path)
+                    self._index_elements(item, elements, depth + 1, i, tag_path, encodings)
 
         return elements
 
-    def _safe_value(self, name, value, ignore_values):
+    def _safe_value(self, name, value, ignore_values, vr=None, encodings=DEFAULT_ENCODINGS):
         if name in ignore_values:
             return '<REMOVED>' if value else '<>'
-        return f'<{str(self._convert_bytes(value)).strip()}>' if value is not None else '<>'
-
-    def _convert_bytes(self, value):
-        if not isinstance(value, bytes):
-            return value
-        try:
-            encoding = chardet.detect(value)['encoding'] or 'utf-8'
-            return value.decode(encoding)
-        except Exception:
-            return value
+        if value is None:
+            return '<>'
+        # UN and private values keep their NUL padding, which PostgreSQL text columns reject
+        return f'<{str(decode_value(value, vr, encodings)).replace(chr(0), "").strip()}>'
@@ -0,0 +1,92 @@
+# posda_utils/io/walker.py
+
+import os
+import logging
+from fnmatch import fnmatch
+
+logger = logging.getLogger(__name__)
+
+DICOM_PREAMBLE_SIZE = 128
+DICOM_MAGIC = b"DICM"
+SYMLINK_POLICIES = ("follow", "files", "skip")
+
+
+def is_dicom_file(path):
+    """Check for the 128-byte preamble and DICM prefix with a single small read."""
+    try:
+        with open(path, "rb", buffering=0) as f:
+            return f.read(DICOM_PREAMBLE_SIZE + 4)[DICOM_PREAMBLE_SIZE:] == DICOM_MAGIC
+    except OSError:
+        return False
+
+
+def walk_files(directory_path, include=None, exclude=None, symlinks="follow", include_hidden=False, dicom_only=False,
+               keep=None):
+    """Yield the files under directory_path as they are found, using os.scandir.
+
+    include/exclude are fnmatch patterns tested against the entry name and the
+    '/'-separated path relative to directory_path. Excluded directories are not
+    descended into. symlinks is "follow" (links to files and directories),
+    "files" (links to files only) or "skip". Hidden entries are skipped unless
+    include_hidden, as glob does. dicom_only sniffs the DICM magic first;
+    files for which the keep predicate is true (e.g. archives) skip the sniff.
+    """
+    if symlinks not in SYMLINK_POLICIES:
+        raise ValueError(f"symlinks must be one of {SYMLINK_POLICIES}, got '{symlinks}'")
+
+    include = [include] if isinstance(include, str) else list(include or [])
+    exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+    prefix_length = len(os.path.join(directory_path, ""))
+
+    root = os.stat(directory_path)
+    visited = {(root.st_dev, root.st_ino)}
+    stack = [directory_path]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"Cannot read directory {current}: {e}")
+            continue
+
+        for entry in entries:
+            if not include_hidden and entry.name.startswith("."):
+                continue
+
+            is_link = entry.is_symlink()
+            if is_link and symlinks == "skip":
+                continue
+
+            relative = entry.path[prefix_length:].replace(os.sep, "/")
+            try:
+                if entry.is_dir(follow_symlinks=symlinks == "follow"):
+                    if exclude and _matches(exclude, entry.name, relative):
+                        continue
+                    if symlinks == "follow":
+                        # Guard against symlink loops
+                        stat = entry.stat()
+                        if (stat.st_dev, stat.st_ino) in visited:
+                            continue
+                        visited.add((stat.st_dev, stat.st_ino))
+                    stack.append(entry.path)
+                    continue
+
+                if not entry.is_file():
+                    continue
+            except OSError as e:
+                logger.warning(f"Cannot stat {entry.path}: {e}")
+                continue
+
+            if include and not _matches(include, entry.name, relative):
+                continue
+            if exclude and _matches(exclude, entry.name, relative):
+                continue
+            if dicom_only and not (keep and keep(entry.path)) and not is_dicom_file(entry.path):
+                continue
+
+            yield entry.path
+
+
+def _matches(patterns, name, relative):
+    return any(fnmatch(name, pattern) or fnmatch(relative, pattern) for pattern in patterns)
@@ -45,25 +45,22 @@ class PosdaDB(DBManager):
         for row in results:
             if only_diff and not row.get("different"):
                 continue
-            compare_rows.append(DicomCompare(
-                origin_file_id=file_id_1,
-                terminal_file_id=file_id_2,
-                tag=sanitize_string(row.get("tag")),
-                tag_path=sanitize_string(row.get("tag_path")),
-                tag_group=sanitize_string(row.get("tag_group")),
-                tag_element=sanitize_string(row.get("tag_element")),
-                tag_name=sanitize_string(row.get("tag_name")),
-                tag_keyword=sanitize_string(row.get("tag_keyword")),
-                tag_vr=sanitize_string(row.get("tag_vr")),
-                tag_vm=sanitize_string(row.get("tag_vm")),
-                is_private=row.get("is_private"),
-                private_creator=sanitize_string(row.get("private_creator")),
-                origin_value=sanitize_string(row.get(f"{label_1}_value")),
-                terminal_value=sanitize_string(row.get(f"{label_2}_value")),
-                is_different=row.get("different"),
-            ))
+            compare_rows.append({
+                "origin_file_id": file_id_1,
+                "terminal_file_id": file_id_2,
+                "tag": sanitize_string(row.get("tag")),
+                "tag_path": sanitize_string(row.get("tag_path")),
+                "tag_group": sanitize_string(row.get("tag_group")),
+                "tag_element": sanitize_string(row.get("tag_element")),
+                "tag_name": sanitize_string(row.get("tag_name")),
+                "tag_keyword": sanitize_string(row.get("tag_keyword")),
+                "tag_vr": sanitize_string(row.get("tag_vr")),
+                "tag_vm": sanitize_string(row.get("tag_vm")),
+                "is_private": row.get("is_private"),
+                "private_creator": sanitize_string(row.get("private_creator")),
+                "origin_value": sanitize_string(row.get(f"{label_1}_value")),
+                "terminal_value": sanitize_string(row.get(f"{label_2}_value")),
+                "is_different": row.get("different"),
+            })
 
-        if compare_rows:
-            with self._get_session() as session:
-                session.add_all(compare_rows)
-                session.commit()
\ No newline at end of file
+        self.bulk_load(DicomCompare, compare_rows)
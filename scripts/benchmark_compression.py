@@ -0,0 +1,94 @@
+import os
+import time
+import logging
+import argparse
+import tempfile
+import warnings
+
+from posda_utils.db.database import DBManager
+from posda_utils.db.models import DicomIndex
+from posda_utils.io.indexer import DicomIndexer
+from posda_utils.io.codec import JsonCodec, train_dictionary, register_dictionary, decompress_json
+from posda_utils.compare.tag_matrix import build_dicomfile
+
+warnings.filterwarnings("ignore", module="pydicom")
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+
+logger = logging.getLogger(__name__)
+
+FETCH_COLUMNS = ["sop_instance_uid", "header_data", "meta_data", "header_packed", "meta_packed",
+                 "pixel_digest", "pixel_size"]
+
+
+def index_into(directory, db_path, compression, cpus):
+    with DBManager(f"sqlite:///{db_path}") as db:
+        DicomIndexer().index_directory(directory, cpus=cpus, multiproc=cpus > 1, group_name="benchmark",
+                                       db_manager=db, header_only=True, compression=compression,
+                                       return_df=False)
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.exec_driver_sql("VACUUM")
+    return os.path.getsize(db_path)
+
+
+def fetch(db_path, parse=True):
+    """Stream the tag matrix columns, decompress them and optionally parse every row.
+
+    Returns rows per second.
+    """
+    count = 0
+    start = time.perf_counter()
+    with DBManager(f"sqlite:///{db_path}") as db:
+        for rows in db.iter_query(DicomIndex, params={"group_name": "benchmark"}, columns=FETCH_COLUMNS,
+                                  chunk_size=1000):
+            for row in rows:
+                try:
+                    if parse:
+                        build_dicomfile(row._asdict())
+                    else:
+                        decompress_json(row.header_data if row.header_data is not None else row.header_packed)
+                        decompress_json(row.meta_data if row.meta_data is not None else row.meta_packed)
+                    count += 1
+                except Exception as e:
+                    logger.debug(f"Skipped unparsable row {row.sop_instance_uid}: {e}")
+    return count / (time.perf_counter() - start)
+
+
+def measure(directory, db_path, compression, cpus):
+    return index_into(directory, db_path, compression, cpus), fetch(db_path, parse=False), fetch(db_path)
+
+
+def sample_headers(db_path, count):
+    with DBManager(f"sqlite:///{db_path}") as db:
+        rows = db.run_query(f"SELECT header_data FROM dicom_index WHERE header_data IS NOT NULL LIMIT {int(count)}")
+    return [row[0] for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="dicom_index size and fetch throughput with JSON compression")
+    parser.add_argument("directory")
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--dict-samples", type=int, default=500, help="headers used to train the dictionary")
+    parser.add_argument("--cpus", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path = os.path.join(tmp, "plain.db")
+        results = {"text": measure(args.directory, plain_path, None, args.cpus)}
+
+        zstd_path = os.path.join(tmp, "zstd.db")
+        results["zstd"] = measure(args.directory, zstd_path, JsonCodec(args.level), args.cpus)
+
+        dictionary = train_dictionary(sample_headers(plain_path, args.dict_samples))
+        register_dictionary(dictionary)
+        dict_path = os.path.join(tmp, "zstd_dict.db")
+        results["zstd+dict"] = measure(args.directory, dict_path, JsonCodec(args.level, dictionary), args.cpus)
+
+    logger.info(f"{'encoding':<10} {'db MB':>10} {'ratio':>8} {'fetch rows/s':>14} {'parse rows/s':>14}")
+    plain_size = results["text"][0]
+    for encoding, (size, fetch_rate, parse_rate) in results.items():
+        logger.info(f"{encoding:<10} {size / 1048576:>10.2f} {plain_size / size:>8.2f} "
+                    f"{fetch_rate:>14.0f} {parse_rate:>14.0f}")
@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+import argparse
+import tempfile
+
+from posda_utils.io.hasher import HASH_ALGORITHMS, hash_file, hash_files
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+)
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZES = [8192, 65536, 1048576, 8388608]
+
+
+def make_files(directory, count, size_mb):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"bench_{i:03d}.bin")
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1048576))
+        paths.append(path)
+    return paths
+
+
+def benchmark_single_file(path, repeat):
+    size_mb = os.path.getsize(path) / 1048576
+    logger.info(f"Single file ({size_mb:.0f} MB), best of {repeat}")
+    logger.info(f"{'algorithm':<10} {'buffer':>10} {'mode':>6} {'MB/s':>10}")
+
+    for algorithm in HASH_ALGORITHMS:
+        for buffer_size in BUFFER_SIZES:
+            for use_mmap in (False, True):
+                best = min(timed(hash_file, path, buffer_size, algorithm, use_mmap) for _ in range(repeat))
+                mode = "mmap" if use_mmap else "read"
+                logger.info(f"{algorithm:<10} {buffer_size:>10} {mode:>6} {size_mb / best:>10.1f}")
+
+
+def benchmark_threads(paths, workers):
+    total_mb = sum(os.path.getsize(p) for p in paths) / 1048576
+    logger.info(f"{len(paths)} files ({total_mb:.0f} MB) on a thread pool")
+    logger.info(f"{'algorithm':<10} {'threads':>10} {'MB/s':>10}")
+
+    for algorithm in HASH_ALGORITHMS:
+        for max_workers in workers:
+            elapsed = timed(hash_files, paths, max_workers, 1048576, algorithm)
+            logger.info(f"{algorithm:<10} {max_workers:>10} {total_mb / elapsed:>10.1f}")
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Digest throughput per algorithm, buffer size and thread count")
+    parser.add_argument("--size-mb", type=int, default=256, help="size of each generated file")
+    parser.add_argument("--files", type=int, default=8, help="number of files for the thread pool run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_files(tmp, args.files, args.size_mb)
+        benchmark_single_file(paths[0], args.repeat)
+        benchmark_threads(paths, args.workers)
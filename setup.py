@@ -10,7 +10,6 @@ setup(
     python_requires=">=3.10",
     install_requires=[
         "pydicom>=3.0.1",
-        "chardet>=5.2.0",
         "tqdm>=4.67.1",
         "pyarrow>=20.0.0",
         "pandas>=2.3.0",
@@ -19,6 +18,10 @@ setup(
         "psycopg2-binary>=2.9.10",
         "pymysql>=1.1.1"
     ],
+    extras_require={
+        "fast-hash": ["blake3>=1.0.0", "xxhash>=3.5.0"],
+        "zstd": ["zstandard>=0.22.0"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.10",
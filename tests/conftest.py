@@ -0,0 +1,110 @@
+import os
+
+import pytest
+from sqlalchemy import text
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from posda_utils.db.database import DBManager
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+
+# dicom_index as created before digests, packed JSON and binary pixel data were added
+BASELINE_DICOM_INDEX = """
+    CREATE TABLE dicom_index (
+        index_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_name VARCHAR, file_path VARCHAR,
+        sop_class_uid VARCHAR, modality VARCHAR, patient_id VARCHAR,
+        study_instance_uid VARCHAR, series_instance_uid VARCHAR, sop_instance_uid VARCHAR,
+        header_data TEXT, header_digest VARCHAR, header_size BIGINT,
+        meta_data TEXT, meta_digest VARCHAR, meta_size BIGINT,
+        pixel_data TEXT, pixel_digest VARCHAR, pixel_size BIGINT
+    )
+"""
+
+
+def _write_dicom(path, sop_instance_uid=None, patient_name="Test^Patient", pixels=b"\x00\x01" * 16,
+                 transfer_syntax=ExplicitVRLittleEndian, trailing=None):
+    """Write a small CT file; with sop_instance_uid=False the file has no SOP Instance UID.
+
+    For an encapsulated transfer_syntax, pixels must already be encapsulated.
+    trailing is written as DataSetTrailingPadding, after the pixel data.
+    """
+    if sop_instance_uid is None:
+        sop_instance_uid = generate_uid()
+
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = CT_IMAGE_STORAGE
+    file_meta.MediaStorageSOPInstanceUID = sop_instance_uid or generate_uid()
+    file_meta.TransferSyntaxUID = transfer_syntax
+
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = CT_IMAGE_STORAGE
+    if sop_instance_uid:
+        ds.SOPInstanceUID = sop_instance_uid
+    ds.PatientName = patient_name
+    ds.PatientID = "TEST-001"
+    ds.Modality = "CT"
+    ds.StudyInstanceUID = "1.2.826.0.1.3680043.8.498.1"
+    ds.SeriesInstanceUID = "1.2.826.0.1.3680043.8.498.2"
+    ds.SliceThickness = "1.25"
+    ds.Rows, ds.Columns = 4, 4
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 16, 15
+    ds.SamplesPerPixel, ds.PixelRepresentation = 1, 0
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.PixelData = pixels
+    if transfer_syntax.is_encapsulated:
+        ds["PixelData"].VR = "OB"
+        ds["PixelData"].is_undefined_length = True
+    if trailing is not None:
+        ds.DataSetTrailingPadding = trailing
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ds.save_as(path, enforce_file_format=True)
+    return sop_instance_uid
+
+
+@pytest.fixture
+def dicom_dir(tmp_path):
+    """A directory of three DICOM files and one non-DICOM file."""
+    directory = tmp_path / "dicom"
+    for i in range(3):
+        _write_dicom(str(directory / f"image_{i}.dcm"), patient_name=f"Test^Patient{i}")
+    (directory / "notes.txt").write_text("not dicom")
+    return str(directory)
+
+
+@pytest.fixture
+def db(tmp_path):
+    with DBManager(f"sqlite:///{tmp_path / 'index.db'}") as db_manager:
+        yield db_manager
+
+
+def _create_baseline_table(db_manager, rows=()):
+    with db_manager.engine.begin() as conn:
+        conn.execute(text(BASELINE_DICOM_INDEX))
+        for row in rows:
+            conn.execute(text(f"INSERT INTO dicom_index ({', '.join(row)}) VALUES ({', '.join(':' + c for c in row)})"), row)
+
+
+def _count_rows(db_manager, table_name, where=""):
+    return db_manager.run_query(f"SELECT COUNT(*) FROM {table_name} {where}")[0][0]
+
+
+@pytest.fixture
+def write_dicom():
+    """Writer of small CT files, see _write_dicom."""
+    return _write_dicom
+
+
+@pytest.fixture
+def count_rows():
+    """Row counter for a table, with an optional WHERE clause."""
+    return _count_rows
+
+
+@pytest.fixture
+def create_baseline_table():
+    """Creator of a dicom_index table in its original layout, filled with the given row dicts."""
+    return _create_baseline_table
@@ -0,0 +1,40 @@
+import pydicom
+
+from posda_utils.compare.file_compare import DicomFileComparer
+from posda_utils.io.reader import DicomFile
+
+
+def load_json_pair(tmp_path, write_dicom, second_name="Test^Patient"):
+    uid = write_dicom(str(tmp_path / "a.dcm"))
+    write_dicom(str(tmp_path / "b.dcm"), sop_instance_uid=uid, patient_name=second_name)
+
+    files = []
+    for name in ("a.dcm", "b.dcm"):
+        source = DicomFile()
+        source.from_dicom_path(str(tmp_path / name))
+        loaded = DicomFile()
+        loaded.from_json(source.meta_json, source.header_json, None)
+        files.append(loaded)
+    return files
+
+
+def test_identical_pair_is_not_parsed(tmp_path, monkeypatch, write_dicom):
+    calls = []
+    from_json = pydicom.Dataset.from_json
+    monkeypatch.setattr(pydicom.Dataset, "from_json", lambda *args, **kwargs: calls.append(1) or from_json(*args, **kwargs))
+    dicom_01, dicom_02 = load_json_pair(tmp_path, write_dicom)
+
+    rows = DicomFileComparer().compare({}, dicom_01, "g1", dicom_02, "g2", only_diff=True)
+
+    assert rows == []
+    assert calls == []
+
+
+def test_differing_pair_returns_only_changed_tags(tmp_path, write_dicom):
+    dicom_01, dicom_02 = load_json_pair(tmp_path, write_dicom, second_name="Other^Patient")
+
+    rows = DicomFileComparer().compare({}, dicom_01, "g1", dicom_02, "g2", only_diff=True)
+
+    assert [row["tag_keyword"] for row in rows] == ["PatientName"]
+    assert rows[0]["g1_value"] == "<Test^Patient>" and rows[0]["g2_value"] == "<Other^Patient>"
+    assert dicom_01.header_data.PatientName == "Test^Patient"
@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event
+
+from posda_utils.db import database
+from posda_utils.db.models import DicomIndex
+from posda_utils.io.indexer import DicomIndexer, UPSERT_KEY, UPSERT_COMPARE
+
+def test_older_table_gets_missing_columns(db, dicom_dir, count_rows, create_baseline_table):
+    create_baseline_table(db)
+
+    DicomIndexer().index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db, digest_file=True)
+
+    columns = {row[1] for row in db.run_query("PRAGMA table_info(dicom_index)")}
+    assert {"file_digest", "file_size", "digest_algorithm", "header_packed", "meta_packed"} <= columns
+    assert count_rows(db, "dicom_index", "WHERE file_digest IS NOT NULL") == 3
+
+
+def test_duplicate_keys_block_the_unique_index(db, create_baseline_table):
+    row = {"group_name": "g1", "sop_instance_uid": "1.2.3", "file_path": "/a.dcm"}
+    create_baseline_table(db, [row, row])
+
+    with pytest.raises(RuntimeError, match="duplicate"):
+        db.create_table_from_model(DicomIndex)
+
+
+def upsert_rows(count, value):
+    return [{"group_name": "g1", "sop_instance_uid": f"1.2.{i}", "file_path": f"/{i}.dcm", "header_digest": value,
+             "patient_id": "P", "modality": "CT", "header_data": "{}", "meta_data": "{}"} for i in range(count)]
+
+
+def test_upsert_fits_old_sqlite_variable_limit(db, monkeypatch, count_rows):
+    monkeypatch.setattr(database, "SQLITE_MAX_VARIABLES", 999)
+    db.engine.dispose()
+    event.listen(db.engine, "connect",
+                 lambda dbapi_connection, _: dbapi_connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999))
+    db.create_table_from_model(DicomIndex)
+
+    db.bulk_upsert(DicomIndex, upsert_rows(1000, "a"), UPSERT_KEY, UPSERT_COMPARE)
+    db.bulk_upsert(DicomIndex, upsert_rows(1000, "b"), UPSERT_KEY, UPSERT_COMPARE)
+
+    assert count_rows(db, "dicom_index", "WHERE header_digest = 'b'") == 1000
+
+
+def test_upsert_falls_back_to_replace_on_other_dialects(db, monkeypatch, count_rows):
+    db.create_table_from_model(DicomIndex)
+    db.bulk_upsert(DicomIndex, upsert_rows(3, "a"), UPSERT_KEY, UPSERT_COMPARE)
+    monkeypatch.setattr(db.engine.dialect, "name", "other")
+
+    rows = upsert_rows(4, "b")
+    rows[0]["sop_instance_uid"] = None
+    db.bulk_upsert(DicomIndex, rows, UPSERT_KEY, UPSERT_COMPARE)
+    db.bulk_upsert(DicomIndex, rows, UPSERT_KEY, UPSERT_COMPARE)
+
+    assert count_rows(db, "dicom_index") == 5
+    assert count_rows(db, "dicom_index", "WHERE header_digest = 'b'") == 4
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from posda_utils.io.hasher import HashingReader, hash_file
+from posda_utils.io.reader import DicomFile
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(200000))
+    return str(path)
+
+
+def test_hashing_reader_survives_backward_seeks(data_file):
+    with HashingReader(data_file, buffer_size=4096) as reader:
+        reader.read(100)
+        reader.seek(10)
+        reader.read(50)
+        reader.seek(0)
+        reader.read(20)
+        reader.seek(150000)
+        reader.read(10)
+        reader.seek(-5, os.SEEK_CUR)
+        reader.read(1000)
+        assert reader.digest() == hash_file(data_file)
+
+
+def test_hashing_reader_rereads_after_full_read(data_file):
+    with HashingReader(data_file) as reader:
+        reader.read()
+        reader.seek(0)
+        reader.read(1000)
+        assert reader.digest() == hash_file(data_file)
+
+
+@pytest.mark.parametrize("header_only", [False, True])
+def test_file_digest_matches_hash_file(tmp_path, write_dicom, header_only):
+    path = str(tmp_path / "image.dcm")
+    write_dicom(path, pixels=bytes(range(256)) * 64, trailing=b"\x00" * 8)
+
+    dicom_file = DicomFile()
+    dicom_file.from_dicom_path(path, header_only=header_only, digest_file=True)
+
+    assert (dicom_file.file_size, dicom_file.file_digest) == hash_file(path)
@@ -0,0 +1,102 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from posda_utils.io.indexer import DicomIndexer
+
+
+def test_archives_are_kept_when_sniffing(tmp_path, write_dicom):
+    source = tmp_path / "source"
+    paths = [str(source / f"image_{i}.dcm") for i in range(4)]
+    for path in paths:
+        write_dicom(path)
+
+    archive_dir = tmp_path / "archives"
+    archive_dir.mkdir()
+    with zipfile.ZipFile(archive_dir / "series.zip", "w") as zf:
+        for path in paths[:2]:
+            zf.write(path, os.path.basename(path))
+    with tarfile.open(archive_dir / "series.tar.gz", "w:gz") as tf:
+        for path in paths[2:]:
+            tf.add(path, os.path.basename(path))
+
+    df = DicomIndexer().index_directory(str(archive_dir), multiproc=False, archives=True, sniff_dicom=True)
+
+    assert len(df) == 4
+    assert all("!" in path for path in df["file_path"])
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_reindex_keeps_one_row_for_files_without_sop_uid(db, dicom_dir, stream, write_dicom, count_rows):
+    write_dicom(os.path.join(dicom_dir, "no_uid.dcm"), sop_instance_uid=False)
+
+    for _ in range(2):
+        DicomIndexer().index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db, stream=stream)
+
+    assert count_rows(db, "dicom_index") == 4
+    assert count_rows(db, "dicom_index", "WHERE sop_instance_uid IS NULL") == 1
+
+
+def test_reindex_without_compression_unpacks_rows(db, dicom_dir, count_rows):
+    pytest.importorskip("zstandard")
+    indexer = DicomIndexer()
+
+    indexer.index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db, compression=True)
+    assert count_rows(db, "dicom_index", "WHERE header_packed IS NOT NULL AND header_data IS NULL") == 3
+
+    indexer.index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db)
+    rows = db.run_query("SELECT header_data, meta_data, header_packed, meta_packed FROM dicom_index")
+
+    assert len(rows) == 3
+    for header_data, meta_data, header_packed, meta_packed in rows:
+        assert header_data.startswith("{") and meta_data.startswith("{")
+        assert header_packed is None and meta_packed is None
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_elements_are_written_in_both_modes(db, dicom_dir, stream):
+    DicomIndexer().index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db,
+                                   elements=True, stream=stream)
+
+    per_file = db.run_query("SELECT file_path, COUNT(*) FROM dicom_element GROUP BY file_path")
+    assert len(per_file) == 3
+    assert all(count > 10 for _, count in per_file)
+
+
+def test_stream_reindex_deletes_rows_of_vanished_files(db, dicom_dir, write_dicom, count_rows):
+    write_dicom(os.path.join(dicom_dir, "no_uid.dcm"), sop_instance_uid=False)
+    indexer = DicomIndexer()
+    indexer.index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db, stream=True)
+    indexer.index_directory(dicom_dir, multiproc=False, group_name="g2", db_manager=db, stream=True)
+
+    os.remove(os.path.join(dicom_dir, "image_0.dcm"))
+    indexer.index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db, stream=True,
+                            write_batch_size=1)
+
+    paths = {os.path.basename(row[0]) for row in
+             db.run_query("SELECT file_path FROM dicom_index WHERE group_name = 'g1'")}
+    assert paths == {"image_1.dcm", "image_2.dcm", "no_uid.dcm"}
+    assert count_rows(db, "dicom_index", "WHERE group_name = 'g2'") == 4
+    assert count_rows(db, "dicom_index_seen") == 0
+
+
+@pytest.mark.parametrize("mode", ["list", "stream", "reindex"])
+def test_element_rows_follow_files_without_elements(db, dicom_dir, mode, write_dicom):
+    indexer = DicomIndexer()
+
+    def index(elements):
+        if mode == "reindex":
+            indexer.reindex_directory(dicom_dir, "g1", db, multiproc=False, elements=elements)
+        else:
+            indexer.index_directory(dicom_dir, multiproc=False, group_name="g1", db_manager=db,
+                                    elements=elements, stream=mode == "stream")
+
+    index(elements=True)
+    os.remove(os.path.join(dicom_dir, "image_0.dcm"))
+    write_dicom(os.path.join(dicom_dir, "image_1.dcm"), patient_name="Changed^Patient^Name")
+    index(elements=False)
+
+    paths = {os.path.basename(row[0]) for row in db.run_query("SELECT DISTINCT file_path FROM dicom_element")}
+    assert paths == ({"image_2.dcm"} if mode == "reindex" else set())
@@ -0,0 +1,81 @@
+import pytest
+import pydicom
+from pydicom.data import get_testdata_file
+from pydicom.encaps import encapsulate
+from pydicom.uid import ImplicitVRLittleEndian, JPEGBaseline8Bit
+
+from posda_utils.io.reader import DicomFile, iter_dataset_json
+
+NATIVE_PIXELS = bytes(range(256)) * 2
+FRAMES = [b"\xff\xd8frame one\xff\xd9", b"\xff\xd8frame two, a little longer\xff\xd9"]
+
+PIXEL_LAYOUTS = {
+    "native": dict(pixels=NATIVE_PIXELS),
+    "implicit_vr": dict(pixels=NATIVE_PIXELS, transfer_syntax=ImplicitVRLittleEndian),
+    "encapsulated": dict(pixels=encapsulate(FRAMES), transfer_syntax=JPEGBaseline8Bit),
+    "trailing_elements": dict(pixels=NATIVE_PIXELS, trailing=b"\x00" * 8),
+}
+
+
+def load(path, **kwargs):
+    dicom_file = DicomFile()
+    dicom_file.from_dicom_path(path, **kwargs)
+    assert dicom_file.exists
+    return dicom_file
+
+
+@pytest.mark.parametrize("layout", sorted(PIXEL_LAYOUTS))
+def test_header_only_read_matches_full_read(tmp_path, write_dicom, layout):
+    path = str(tmp_path / f"{layout}.dcm")
+    write_dicom(path, **PIXEL_LAYOUTS[layout])
+
+    full = load(path, retain_pixel_data=True)
+    header_only = load(path, header_only=True)
+    header_only_retained = load(path, header_only=True, retain_pixel_data=True)
+
+    assert header_only.pixel_digest == full.pixel_digest
+    assert header_only.pixel_size == full.pixel_size
+    assert header_only_retained.pixel_data == full.pixel_data
+    assert header_only.header_digest == full.header_digest
+    assert header_only.meta_digest == full.meta_digest
+    assert header_only.pixel_data is None
+    assert header_only.pixel_offset is not None
+
+
+def test_elements_after_pixel_data_stay_in_header(tmp_path, write_dicom):
+    path = str(tmp_path / "trailing.dcm")
+    write_dicom(path, trailing=b"\x00" * 8)
+
+    header_only = load(path, header_only=True)
+
+    assert "DataSetTrailingPadding" in header_only.header_data
+    assert "PixelData" not in header_only.header_data
+
+
+@pytest.mark.parametrize("name", ["CT_small.dcm", "MR_small.dcm", "rtplan.dcm"])
+def test_iter_dataset_json_matches_to_json(name):
+    dataset = pydicom.dcmread(get_testdata_file(name))
+    dataset.add_new(0x00091010, "LO", "private value")
+
+    assert "".join(iter_dataset_json(dataset, exclude=())) == dataset.to_json()
+    assert "".join(iter_dataset_json(dataset.file_meta)) == dataset.file_meta.to_json()
+
+    dataset.pop(0x7FE00010, None)
+    assert "".join(iter_dataset_json(dataset)) == dataset.to_json()
+
+
+def test_loaded_json_matches_to_json(tmp_path, write_dicom):
+    path = str(tmp_path / "image.dcm")
+    write_dicom(path)
+
+    dataset = pydicom.dcmread(path)
+    del dataset.PixelData
+    dicom_file = load(path)
+
+    assert dicom_file.header_json == dataset.to_json()
+    assert dicom_file.meta_json == dataset.file_meta.to_json()
+
+
+@pytest.mark.parametrize("vr, value", [("UN", b"ABC\x00"), ("LO", "ABC\x00 ")])
+def test_values_drop_nul_padding(vr, value):
+    assert DicomFile()._safe_value("Private Value", value, set(), vr) == "<ABC>"
@@ -0,0 +1,40 @@
+import os
+
+from posda_utils.compare.tag_matrix import TagMatrixBuilder
+from posda_utils.io.indexer import DicomIndexer
+from posda_utils.io.reader import DicomFile
+
+BASELINE_COLUMNS = ("group_name", "file_path", "sop_instance_uid", "header_data", "header_digest",
+                    "meta_data", "meta_digest", "pixel_digest", "pixel_size")
+
+
+def test_matrix_builds_from_older_table(db, dicom_dir, create_baseline_table, count_rows):
+    rows = []
+    for name in sorted(os.listdir(dicom_dir)):
+        if not name.endswith(".dcm"):
+            continue
+        dicom_file = DicomFile()
+        dicom_file.from_dicom_path(os.path.join(dicom_dir, name))
+        for group_name in ("g1", "g2"):
+            row = dicom_file.to_index_row(group_name)
+            rows.append({c: row[c] for c in BASELINE_COLUMNS})
+    create_baseline_table(db, rows)
+
+    TagMatrixBuilder(db, ["g1", "g2"]).build_matrix(multiproc=False)
+
+    assert count_rows(db, "tag_matrix", "WHERE tag = '<(0010,0010)>'") == 3
+
+
+def test_failed_fetch_is_rebuilt_next_time(db, dicom_dir, monkeypatch, count_rows):
+    for group_name in ("g1", "g2"):
+        DicomIndexer().index_directory(dicom_dir, multiproc=False, group_name=group_name, db_manager=db)
+    run_query = db.run_query
+    monkeypatch.setattr(db, "run_query", lambda query, *args, **kwargs:
+                        None if "header_packed" in str(query) else run_query(query, *args, **kwargs))
+
+    TagMatrixBuilder(db, ["g1", "g2"]).build_matrix(multiproc=False, incremental=True)
+    assert count_rows(db, "tag_matrix_state") == 0
+
+    monkeypatch.undo()
+    TagMatrixBuilder(db, ["g1", "g2"]).build_matrix(multiproc=False, incremental=True)
+    assert count_rows(db, "tag_matrix", "WHERE tag = '<(0010,0010)>'") == 3